@@ -0,0 +1,621 @@
+"""Deterministic simulation harness and benchmarks for cosmog-monitor-agent.py.
+
+Runs the agent's real monitor logic (status parsing, fleet diffing, escalation
+policy, remediation jobs, history) against a simulated fleet:
+- a fake Rotom /api/status server for 10 to 10,000 parents with scripted failures
+- a fake adb backend whose app restarts and reboots act on the simulated devices
+- a virtual clock, so hours of monitoring run in seconds and the same seed always
+  gives the same timeline
+
+Reports detection latency, time to remediation and to recovery (virtual seconds),
+CPU time and memory allocated per poll, and discover_devices() scan durations.
+Also starts two sites through Monitor.run() in real time and reports how long
+their fleets take to show up, including the first poll after the startup check.
+
+    python benchmark.py --sizes 10,100,1000,10000 --hours 2 --seed 1 --json bench.json
+"""
+import argparse
+import asyncio
+import configparser
+import heapq
+import importlib.util
+import ipaddress
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from collections import deque
+from concurrent.futures import Future
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+AGENT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cosmog-monitor-agent.py")
+
+# (seconds after start, failure kind, share of the fleet or device count, duration for outages)
+SCENARIOS = {
+    "steady": [],
+    "mixed": [
+        (600, "crash", 0.03, None),
+        (1800, "hang", 0.02, None),
+        (2700, "move", 0.01, None),
+        (3600, "wedge", 0.01, None),
+        (4500, "degrade", 0.02, None),
+        (5400, "dead", 1, None),
+    ],
+    "outage": [
+        (600, "outage", None, 900),
+        (3600, "crash", 0.02, None),
+    ],
+}
+
+def load_agent(workdir, config_file=None):
+    """Import the agent with a config.ini in workdir, so its files end up there."""
+    parser = configparser.ConfigParser()
+    if config_file:
+        parser.read(config_file)
+    defaults = dict(parser['DEFAULT'])
+    defaults['METRICS_PORT'] = '0'
+    config = configparser.ConfigParser()
+    config['DEFAULT'] = defaults
+    with open(os.path.join(workdir, 'config.ini'), 'w') as f:
+        config.write(f)
+
+    os.chdir(workdir)
+    spec = importlib.util.spec_from_file_location("cosmog_agent", AGENT_PATH)
+    agent = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(agent)
+    return agent
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(math.ceil(q * len(values))) - 1)]
+    return {"p50": statistics.median(values), "p95": pick(0.95), "max": values[-1], "n": len(values)}
+
+class VirtualClock:
+    """Replacement for the agent's Clock.
+
+    Time only moves when something sleeps or advance() is called. Callbacks scheduled
+    with call_at() fire in order as time passes them, also while a remediation job
+    sleeps, so polls keep happening while a device reboots.
+    """
+
+    def __init__(self, start):
+        self.current = start
+        self._events = []
+        self._sequence = itertools.count()
+
+    def time(self):
+        return self.current
+
+    monotonic = time
+
+    def now(self):
+        return datetime.fromtimestamp(self.current)
+
+    def sleep(self, seconds):
+        self.advance(self.current + seconds)
+
+    def call_at(self, when, callback):
+        heapq.heappush(self._events, (when, next(self._sequence), callback))
+
+    def call_later(self, delay, callback):
+        self.call_at(self.current + delay, callback)
+
+    def next_event(self):
+        return self._events[0][0] if self._events else None
+
+    def advance(self, until):
+        while self._events and self._events[0][0] <= until:
+            when, _, callback = heapq.heappop(self._events)
+            self.current = max(self.current, when)
+            callback()
+        self.current = max(self.current, until)
+
+class SimDevice:
+    __slots__ = ('device_id', 'ip', 'workers', 'failure', 'app_running', 'alive_at', 'booting_until',
+                 'boot_time', 'register_delay')
+
+    def __init__(self, device_id, ip, workers, boot_time, register_delay):
+        self.device_id = device_id
+        self.ip = ip
+        self.workers = workers
+        self.failure = None  # None, "crash", "hang", "degrade", "wedge", "move" or "dead"
+        self.app_running = True
+        self.alive_at = 0.0  # Rotom sees the device once the app has been up this long
+        self.booting_until = 0.0
+        self.boot_time = boot_time
+        self.register_delay = register_delay
+
+    def reachable(self, now):
+        return self.failure != "dead" and now >= self.booting_until
+
+    def is_alive(self, now):
+        return self.reachable(now) and self.app_running and now >= self.alive_at
+
+    def run(self, command, now):
+        if command.startswith("am force-stop"):
+            self.app_running = False
+            return 0, ""
+        if command.startswith("am start"):
+            if self.failure in ("crash", "hang", "degrade", "move"):
+                self.failure = None
+            if self.failure != "wedge":  # A wedged device crash-loops until it is rebooted
+                self.app_running = True
+                self.alive_at = now + self.register_delay
+            return 0, "Starting: Intent { cmp=com.sy1vi3.cosmog/.MainActivity }\n"
+        if command == "getprop sys.boot_completed":
+            return 0, "1\n"
+        if command.startswith("pidof"):
+            return (0, "4242\n") if self.app_running else (1, "")
+        return 127, f"/system/bin/sh: {command.split()[0]}: not found\n"
+
+    def reboot(self, now):
+        self.booting_until = now + self.boot_time
+        self.app_running = False
+        if self.failure != "dead":
+            self.failure = None
+
+class Incident:
+    __slots__ = ('device_id', 'kind', 'at', 'detected', 'remediated', 'recovered')
+
+    def __init__(self, device_id, kind, at):
+        self.device_id = device_id
+        self.kind = kind
+        self.at = at
+        self.detected = None
+        self.remediated = None
+        self.recovered = None
+
+class SimFleet:
+    """Simulated parents, each running workers_per_parent workers, on 10.0.0.0/8.
+
+    The subnet has room for every parent to move to a new address once.
+    """
+
+    def __init__(self, clock, parents, workers_per_parent, seed):
+        self.clock = clock
+        self.rng = random.Random(seed)
+        self.devices = {}
+        self.by_ip = {}
+        base = ipaddress.ip_address("10.0.0.0")
+        for index in range(parents):
+            device_id = f"sim-{index:05d}"
+            device = SimDevice(device_id, str(base + index + 1), workers_per_parent,
+                               boot_time=self.rng.uniform(40, 90), register_delay=self.rng.uniform(10, 30))
+            self.devices[device_id] = device
+            self.by_ip[device.ip] = device
+        self.next_ip = base + parents + 1  # Free addresses for devices that move
+        self.outage_until = 0.0
+        self.incidents = []
+
+    @property
+    def subnet(self):
+        prefix = 32 - max(2, math.ceil(math.log2(2 * len(self.devices) + 2)))
+        return f"10.0.0.0/{prefix}"
+
+    def port_open(self, host, port):
+        device = self.by_ip.get(host)
+        return device is not None and device.reachable(self.clock.time())
+
+    def inject(self, kind, amount, duration):
+        now = self.clock.time()
+        if kind == "outage":
+            self.outage_until = now + duration
+            self.incidents.append(Incident(None, kind, now))
+            return
+        healthy = [device for device in self.devices.values() if device.failure is None and device.is_alive(now)]
+        count = amount if isinstance(amount, int) else max(1, round(amount * len(self.devices)))
+        for device in self.rng.sample(healthy, min(count, len(healthy))):
+            device.failure = kind
+            if kind in ("crash", "wedge", "move"):
+                device.app_running = False
+            if kind == "move":  # New DHCP lease, the registry still has the old address
+                del self.by_ip[device.ip]
+                device.ip = str(self.next_ip)
+                self.next_ip += 1
+                self.by_ip[device.ip] = device
+            self.incidents.append(Incident(device.device_id, kind, now))
+
+    def status(self):
+        now = self.clock.time()
+        outage = now < self.outage_until
+        devices = []
+        workers = []
+        for device in self.devices.values():
+            alive = not outage and device.is_alive(now)
+            running = 0 if not alive or device.failure == "hang" else device.workers
+            if device.failure == "degrade":  # Half of the workers lost their session
+                running = device.workers // 2
+            devices.append({"deviceId": device.device_id, "isAlive": alive, "origin": device.ip,
+                            "version": "0.9.1", "workerCount": running})
+            for index in range(device.workers):
+                allocated = index < running
+                workers.append({"workerId": f"{device.device_id}-w{index}", "isAllocated": allocated,
+                                "parentDeviceId": device.device_id if allocated else None,
+                                "username": f"acct{index}"})
+        return json.dumps({"devices": devices, "workers": workers}).encode()
+
+class FakeRotom:
+    """Serves the simulated fleet as /api/status, with ETags so 304s are exercised."""
+
+    def __init__(self, fleet):
+        self.fleet = fleet
+        self.requests = 0
+        rotom = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                rotom.requests += 1
+                body = rotom.fleet.status()
+                etag = f'"{zlib.crc32(body):08x}"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/api/status"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-rotom", daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+def make_sim_adb(agent, fleet):
+    class SimAdb:
+        """adb backend acting on the simulated devices instead of an adb server."""
+
+        def __init__(self):
+            self.commands = 0
+
+        def _device(self, serial):
+            device = fleet.by_ip.get(serial.rsplit(':', 1)[0])
+            if device is None or not device.reachable(fleet.clock.time()):
+                raise agent.AdbError(f"device '{serial}' not found")
+            return device
+
+        def _remediating(self, device):
+            for incident in fleet.incidents:
+                if incident.device_id == device.device_id and incident.remediated is None:
+                    incident.remediated = fleet.clock.time()
+
+        def connect(self, serial):
+            try:
+                self._device(serial)
+            except agent.AdbError:
+                return f"failed to connect to {serial}"
+            return f"connected to {serial}"
+
+        def disconnect(self, serial):
+            pass
+
+        def get_state(self, serial):
+            self._device(serial)
+            return "device"
+
+        def shell(self, serial, command, timeout=None):
+            self.commands += 1
+            device = self._device(serial)
+            result = 0, ""
+            for part in command.split(" ; "):
+                if part.startswith("am force-stop"):
+                    self._remediating(device)
+                result = device.run(part, fleet.clock.time())
+            return result
+
+        def pull(self, serial, path, timeout=None):
+            self.commands += 1
+            return json.dumps({"device_id": self._device(serial).device_id}).encode()
+
+        def reboot(self, serial):
+            self.commands += 1
+            device = self._device(serial)
+            self._remediating(device)
+            device.reboot(fleet.clock.time())
+
+    return SimAdb()
+
+def make_counting_notifier(agent):
+    class CountingNotifier(agent.DiscordNotifier):
+        """Counts Discord updates instead of sending them."""
+
+        def __init__(self):
+            super().__init__(webhook="http://127.0.0.1:9/unused", state_file=os.devnull)
+            self.sent = []
+
+        def submit(self, status, message):
+            self.sent.append((status, message))
+
+    return CountingNotifier()
+
+class DeferredPool:
+    """Stands in for the remediation thread pool, jobs run from the simulation loop."""
+
+    def __init__(self):
+        self.jobs = deque()
+
+    def submit(self, func, *args):
+        self.jobs.append((func, args))
+
+    def shutdown(self, wait=True):
+        pass
+
+def run_inline(func, *args):
+    """Stands in for Monitor.run_in_thread, so rediscovery runs on the virtual clock."""
+    future = Future()
+    try:
+        future.set_result(func(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def simulate(agent, parents, workers_per_parent, hours, scenario, seed, memory_every, run_dir):
+    start = 1_700_000_000.0
+    clock = VirtualClock(start)
+    agent.clock = clock
+    fleet = SimFleet(clock, parents, workers_per_parent, seed)
+    adb = make_sim_adb(agent, fleet)
+    agent.adb_pool = agent.AdbSessionPool(backend=adb)
+    agent.is_port_open = fleet.port_open
+    notifier = make_counting_notifier(agent)
+    agent.notifier = notifier
+    agent.history = agent.FleetHistory(os.path.join(run_dir, "FleetHistory.db"))
+
+    registry = agent.DeviceRegistry(os.path.join(run_dir, "DeviceRegistry.db"),
+                                    os.path.join(run_dir, "DeviceNameIP.txt"), os.path.join(run_dir, "DeviceIP.txt"))
+    registry.record([(device.device_id, f"{device.ip}:{agent.PORT}") for device in fleet.devices.values()])
+
+    polls = itertools.count()
+    cpu_times = []
+    peak_memory = []
+    outage_jobs = 0
+
+    with FakeRotom(fleet) as rotom:
+        site = agent.Site(agent.config['DEFAULT'], registry, agent.history, notifier, agent.StatusClient(rotom.url))
+        site.subnets = fleet.subnet
+        pool = DeferredPool()
+        monitor = agent.Monitor(site, pool)
+        monitor.run_in_thread = run_inline
+        results = deque()
+        monitor.executor.on_complete = results.append
+
+        def poll():
+            nonlocal outage_jobs
+            measure_memory = memory_every and next(polls) % memory_every == 0
+            if measure_memory:
+                tracemalloc.start()
+            cpu_start = time.thread_time()
+            monitor.evaluate_snapshot(monitor.fetch_status())
+            jobs_before = len(pool.jobs)
+            while not monitor.remediations.empty():
+                monitor.dispatch(*monitor.remediations.get_nowait())
+            if measure_memory:
+                peak_memory.append(tracemalloc.get_traced_memory()[1] / 1024)
+                tracemalloc.stop()
+            else:
+                cpu_times.append((time.thread_time() - cpu_start) * 1000)
+
+            now = clock.time()
+            if now < fleet.outage_until:
+                outage_jobs += len(pool.jobs) - jobs_before
+            track_incidents(fleet, monitor, now)
+            clock.call_later(monitor.scheduler.interval, poll)
+
+        clock.call_at(start, poll)
+        for at, kind, amount, duration in SCENARIOS[scenario]:
+            at += fleet.rng.uniform(0, 90)  # Don't line failures up with the poll interval
+            clock.call_at(start + at, lambda kind=kind, amount=amount, duration=duration: fleet.inject(kind, amount, duration))
+
+        end = start + hours * 3600
+        while True:
+            if pool.jobs:
+                func, args = pool.jobs.popleft()
+                func(*args)  # Remediation jobs sleep on the virtual clock, polls keep firing meanwhile
+            else:
+                next_event = clock.next_event()
+                if next_event is None or next_event > end:
+                    break
+                clock.advance(next_event)
+            while results:
+                monitor.handle_result(results.popleft())
+        site.history.flush()
+        status_requests = rotom.requests
+
+    device_incidents = [incident for incident in fleet.incidents if incident.device_id]
+    counts = monitor.policy.state_counts()
+    return {
+        "parents": parents,
+        "workers": parents * workers_per_parent,
+        "scenario": scenario,
+        "virtual_hours": hours,
+        "polls": len(cpu_times) + len(peak_memory),
+        "status_requests": status_requests,
+        "cpu_ms_per_poll": percentiles(cpu_times),
+        "peak_kib_per_poll": percentiles(peak_memory),
+        "incidents": len(device_incidents),
+        "detection_latency_s": percentiles([i.detected - i.at for i in device_incidents if i.detected]),
+        "time_to_remediation_s": percentiles([i.remediated - i.at for i in device_incidents if i.remediated]),
+        "time_to_recovery_s": percentiles([i.recovered - i.at for i in device_incidents if i.recovered]),
+        "unrecovered": sum(1 for i in device_incidents if not i.recovered),
+        "adb_commands": adb.commands,
+        "quarantined": counts.get(agent.QUARANTINED, 0),
+        "breaker_trips": monitor.policy.breaker.trips,
+        "jobs_during_outage": outage_jobs,
+        "notifications": len(notifier.sent),
+    }
+
+def track_incidents(fleet, monitor, now):
+    for incident in fleet.incidents:
+        if incident.device_id is None or incident.recovered is not None:
+            continue
+        unhealthy = (incident.device_id in monitor.fleet.offline_parents or incident.device_id in monitor.fleet.low_worker_parents
+                     or incident.device_id in monitor.detector.degraded)
+        if incident.detected is None and unhealthy:
+            incident.detected = now
+        elif incident.detected is not None and not unhealthy:
+            incident.recovered = now
+
+def bench_discovery(agent, parents, seed, run_dir):
+    """Time a full scan of the simulated subnet and an incremental one for 1% suspects."""
+    clock = VirtualClock(1_700_000_000.0)
+    agent.clock = clock
+    fleet = SimFleet(clock, parents, 1, seed)
+    agent.adb_pool = agent.AdbSessionPool(backend=make_sim_adb(agent, fleet))
+    agent.is_port_open = fleet.port_open
+    registry = agent.DeviceRegistry(os.path.join(run_dir, "DiscoveryRegistry.db"),
+                                    os.path.join(run_dir, "DiscoveryNameIP.txt"), os.path.join(run_dir, "DiscoveryIP.txt"))
+    site = agent.Site(agent.config['DEFAULT'], registry, agent.history, agent.notifier, agent.status_client)
+    site.subnets = fleet.subnet
+
+    scan_start = time.perf_counter()
+    found = agent.discover_devices(site=site)
+    full = time.perf_counter() - scan_start
+
+    suspects = set(random.Random(seed).sample(sorted(fleet.devices), max(1, parents // 100)))
+    scan_start = time.perf_counter()
+    agent.discover_devices(suspects, site=site)
+    incremental = time.perf_counter() - scan_start
+    return {"addresses": len(agent.get_scan_targets(site.subnets)), "found": len(found),
+            "full_scan_s": full, "incremental_scan_s": incremental}
+
+def bench_startup(agent, parents, workers_per_parent, seed, run_dir, sites=2, timeout=60):
+    """Run Monitor.run() for several sites until every monitor has its fleet and has polled twice.
+
+    Goes through the startup path the simulation skips: the offline check on startup
+    and the first polls, which get a 304 for the payload the startup check fetched.
+    """
+    agent.clock = agent.Clock()
+    fleet = SimFleet(VirtualClock(1_700_000_000.0), parents, workers_per_parent, seed)
+    fleet.inject("crash", 0.02, None)  # Offline at startup, so the startup check restarts them
+    agent.adb_pool = agent.AdbSessionPool(backend=make_sim_adb(agent, fleet))
+    pool = DeferredPool()  # Jobs are only counted, the fleet doesn't move in real time
+
+    config = configparser.ConfigParser(defaults=dict(agent.config['DEFAULT']))
+    config.read_dict({f"site{index}": {} for index in range(sites)})
+
+    async def run(rotoms):
+        monitors = []
+        for index, rotom in enumerate(rotoms):
+            site_dir = os.path.join(run_dir, f"site{index}")
+            os.makedirs(site_dir)
+            registry = agent.DeviceRegistry(os.path.join(site_dir, "DeviceRegistry.db"),
+                                            os.path.join(site_dir, "DeviceNameIP.txt"), os.path.join(site_dir, "DeviceIP.txt"))
+            registry.record([(device.device_id, f"{device.ip}:{agent.PORT}") for device in fleet.devices.values()])
+            site = agent.Site(config[f"site{index}"], registry, agent.FleetHistory(os.path.join(site_dir, "FleetHistory.db")),
+                              make_counting_notifier(agent), agent.StatusClient(rotom.url))
+            site.min_poll_interval = site.max_poll_interval = site.problem_check_interval = 0.2
+            monitors.append(agent.Monitor(site, pool))
+
+        start = time.perf_counter()
+        runs = [asyncio.create_task(monitor.run()) for monitor in monitors]
+        ready = {}
+        try:
+            while len(ready) < len(monitors) and time.perf_counter() - start < timeout:
+                await asyncio.sleep(0.05)
+                for monitor, rotom in zip(monitors, rotoms):
+                    if monitor.fleet.total_parents == parents and rotom.requests >= 3:
+                        ready.setdefault(monitor.site.name, time.perf_counter() - start)
+                for task in runs:
+                    if task.done():
+                        task.result()  # Raises what stopped the monitor
+        finally:
+            for monitor in monitors:
+                monitor.request_stop()
+            await asyncio.gather(*runs, return_exceptions=True)
+        if len(ready) < len(monitors):
+            parents_seen = {monitor.site.name: monitor.fleet.total_parents for monitor in monitors}
+            raise RuntimeError(f"Fleets not populated {timeout}s after Monitor.run() started, parents per site: {parents_seen}")
+        return max(ready.values())
+
+    rotoms = [FakeRotom(fleet) for _ in range(sites)]  # Every site serves the same fleet
+    for rotom in rotoms:
+        rotom.__enter__()
+    try:
+        startup = asyncio.run(run(rotoms))
+    finally:
+        for rotom in rotoms:
+            rotom.__exit__()
+    return {"sites": sites, "startup_s": startup, "startup_jobs": len(pool.jobs)}
+
+def format_stat(stat, unit=""):
+    if not stat:
+        return "-"
+    return f"{stat['p50']:.1f}/{stat['p95']:.1f}/{stat['max']:.1f}{unit}"
+
+def print_report(reports):
+    print(f"{'parents':>8} {'polls':>5} {'cpu ms/poll':>18} {'KiB/poll':>22} {'detect s':>18} "
+          f"{'remediate s':>20} {'recover s':>22} {'unrec':>5} {'quar':>4} {'trips':>5} {'outage jobs':>11} {'scan s':>14} {'start s':>8}")
+    for report in reports:
+        sim, scan, startup = report["simulation"], report["discovery"], report["startup"]
+        print(f"{sim['parents']:>8} {sim['polls']:>5} {format_stat(sim['cpu_ms_per_poll']):>18} "
+              f"{format_stat(sim['peak_kib_per_poll']):>22} {format_stat(sim['detection_latency_s']):>18} "
+              f"{format_stat(sim['time_to_remediation_s']):>20} {format_stat(sim['time_to_recovery_s']):>22} "
+              f"{sim['unrecovered']:>5} {sim['quarantined']:>4} {sim['breaker_trips']:>5} {sim['jobs_during_outage']:>11} "
+              f"{scan['full_scan_s']:>6.2f}/{scan['incremental_scan_s']:.2f} {startup['startup_s']:>8.2f}")
+    print("Latencies are p50/p95/max. Detection, remediation and recovery are virtual seconds after the failure.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the Cosmog monitor against fake fleets and benchmark it.")
+    parser.add_argument("--sizes", default="10,100,1000,10000", help="Comma separated fleet sizes (parent devices).")
+    parser.add_argument("--workers-per-parent", type=int, default=6)
+    parser.add_argument("--hours", type=float, default=2.0, help="Virtual hours to simulate per fleet size.")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="mixed")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--memory-every", type=int, default=10,
+                        help="Trace allocations on every Nth poll, those polls are left out of the CPU numbers. 0 disables it.")
+    parser.add_argument("--config", help="config.ini whose [DEFAULT] thresholds to simulate with.")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    parser.add_argument("--verbose", action="store_true", help="Show the agent's log output.")
+    args = parser.parse_args()
+
+    config_file = os.path.abspath(args.config) if args.config else None
+    json_file = os.path.abspath(args.json) if args.json else None
+    workdir = tempfile.mkdtemp(prefix="cosmog-bench-")
+    agent = load_agent(workdir, config_file)
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.CRITICAL)
+
+    reports = []
+    for size in (int(size) for size in args.sizes.split(",")):
+        run_dir = tempfile.mkdtemp(prefix=f"{size}-", dir=workdir)
+        simulation = simulate(agent, size, args.workers_per_parent, args.hours, args.scenario,
+                              args.seed, args.memory_every, run_dir)
+        discovery = bench_discovery(agent, size, args.seed, run_dir)
+        startup = bench_startup(agent, size, args.workers_per_parent, args.seed, run_dir)
+        reports.append({"simulation": simulation, "discovery": discovery, "startup": startup})
+        print(f"simulated {size} parents: {simulation['polls']} polls, {simulation['incidents']} incidents", file=sys.stderr)
+
+    print_report(reports)
+    if json_file:
+        with open(json_file, "w") as f:
+            json.dump(reports, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Check the native adb backend (AdbClient) against a fake adb server.
+
+Serves the adb host protocol on a local port, with one fake device behind it, and
+runs every AdbClient request against it: host:connect, host:disconnect, get-state,
+host:transport, shell:, sync: RECV and reboot:. Exits non-zero if a check fails.
+
+    python check_adb.py
+"""
+import asyncio
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+
+from benchmark import load_agent
+
+SERIAL = "10.0.0.1:5555"
+SHELL_COMMANDS = {
+    "pidof com.sy1vi3.cosmog": (0, "4242\n"),
+    "getprop sys.boot_completed": (0, "1\n"),
+    "false": (1, ""),
+}
+FILES = {
+    "/data/local/tmp/cosmog.json": b'{"device_id": "sim-00001"}',
+    "/data/local/tmp/large.bin": bytes(range(256)) * 600,  # More than one 64 KiB DATA chunk
+}
+SYNC_DATA_MAX = 65536
+
+class FakeAdbServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeAdbHandler)
+        self.requests_seen = []
+        self.reboots = 0
+        self.drop_session = False  # Fail the next transport like a device whose session is gone
+
+class FakeAdbHandler(socketserver.BaseRequestHandler):
+    def recv_exactly(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return data
+
+    def read_request(self):
+        size = int(self.recv_exactly(4), 16)
+        service = self.recv_exactly(size).decode()
+        self.server.requests_seen.append(service)
+        return service
+
+    def okay(self, reply=None):
+        self.request.sendall(b"OKAY")
+        if reply is not None:
+            self.request.sendall(b"%04x" % len(reply) + reply.encode())
+
+    def fail(self, reason):
+        self.request.sendall(b"FAIL" + b"%04x" % len(reason) + reason.encode())
+
+    def handle(self):
+        try:
+            service = self.read_request()
+            if service.startswith("host:connect:"):
+                self.okay(f"connected to {service[len('host:connect:'):]}")
+            elif service.startswith("host:disconnect:"):
+                self.okay(f"disconnected {service[len('host:disconnect:'):]}")
+            elif service == f"host-serial:{SERIAL}:get-state":
+                self.okay("device")
+            elif service == f"host:transport:{SERIAL}" and self.server.drop_session:
+                self.server.drop_session = False
+                self.fail(f"device '{SERIAL}' offline")
+            elif service == f"host:transport:{SERIAL}":
+                self.okay()
+                self.handle_device(self.read_request())
+            else:
+                self.fail(f"device '{service.split(':')[-1]}' not found")
+        except EOFError:
+            pass
+
+    def handle_device(self, service):
+        if service.startswith("shell:"):
+            command, _, _ = service[len("shell:"):].rpartition(" ; echo :$?")
+            returncode, output = SHELL_COMMANDS.get(command, (127, f"/system/bin/sh: {command}: not found\n"))
+            self.okay()
+            self.request.sendall(f"{output}:{returncode}\n".encode())
+        elif service == "sync:":
+            self.okay()
+            chunk_id, size = struct.unpack("<4sI", self.recv_exactly(8))
+            path = self.recv_exactly(size).decode()
+            assert chunk_id == b"RECV", chunk_id
+            data = FILES.get(path)
+            if data is None:
+                reason = b"No such file or directory"
+                self.request.sendall(b"FAIL" + struct.pack("<I", len(reason)) + reason)
+                return
+            for offset in range(0, len(data), SYNC_DATA_MAX):
+                chunk = data[offset:offset + SYNC_DATA_MAX]
+                self.request.sendall(b"DATA" + struct.pack("<I", len(chunk)) + chunk)
+            self.request.sendall(b"DONE" + struct.pack("<I", 0))
+            assert self.recv_exactly(8) == b"QUIT" + struct.pack("<I", 0)
+        elif service == "reboot:":
+            self.server.reboots += 1
+            self.okay()
+        else:
+            self.fail(f"unknown service {service}")
+
+def expect_error(agent, func, *args):
+    try:
+        func(*args)
+    except agent.AdbError as e:
+        return str(e)
+    raise AssertionError(f"{func.__name__}{args} did not raise AdbError")
+
+def reconnects(agent, client, server):
+    pool = agent.AdbSessionPool(backend=client)
+    pool.connect(SERIAL)
+    server.drop_session = True
+    del server.requests_seen[:]
+    return pool.shell(SERIAL, "false") == (1, "") and f"host:connect:{SERIAL}" in server.requests_seen
+
+def run_checks(agent, client, server):
+    checks = [
+        ("connect", lambda: client.connect(SERIAL) == f"connected to {SERIAL}"),
+        ("disconnect", lambda: client.disconnect(SERIAL) == f"disconnected {SERIAL}"),
+        ("get_state", lambda: client.get_state(SERIAL) == "device"),
+        ("get_state unknown device", lambda: "not found" in expect_error(agent, client.get_state, "10.0.0.9:5555")),
+        ("shell output and exit code", lambda: client.shell(SERIAL, "pidof com.sy1vi3.cosmog") == (0, "4242\n")),
+        ("shell non-zero exit code", lambda: client.shell(SERIAL, "false") == (1, "")),
+        ("shell unknown command", lambda: client.shell(SERIAL, "nope")[0] == 127),
+        ("shell unknown device", lambda: "not found" in expect_error(agent, client.shell, "10.0.0.9:5555", "true")),
+        ("pull", lambda: client.pull(SERIAL, "/data/local/tmp/cosmog.json") == FILES["/data/local/tmp/cosmog.json"]),
+        ("pull several DATA chunks", lambda: client.pull(SERIAL, "/data/local/tmp/large.bin") == FILES["/data/local/tmp/large.bin"]),
+        ("pull missing file", lambda: "No such file" in expect_error(agent, client.pull, SERIAL, "/missing")),
+        ("reboot", lambda: client.reboot(SERIAL) is None and server.reboots == 1),
+        ("shell_async", lambda: asyncio.run(client.shell_async(SERIAL, "getprop sys.boot_completed")) == (0, "1\n")),
+        ("session pool", lambda: agent.AdbSessionPool(backend=client).shell(SERIAL, "false") == (1, "")),
+        ("session pool reconnects a lost session", lambda: reconnects(agent, client, server)),
+    ]
+    failed = 0
+    for name, check in checks:
+        try:
+            ok = check()
+            error = ""
+        except Exception as e:
+            ok = False
+            error = f" ({type(e).__name__}: {e})"
+        failed += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {name}{error}")
+    return failed
+
+def main():
+    agent = load_agent(tempfile.mkdtemp(prefix="cosmog-adb-"))
+    server = FakeAdbServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        client = agent.AdbClient(host="127.0.0.1", port=server.server_address[1], timeout=5)
+        failed = run_checks(agent, client, server)
+    finally:
+        server.shutdown()
+    print(f"{failed} checks failed" if failed else "all checks passed")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
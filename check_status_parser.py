@@ -0,0 +1,149 @@
+"""Check the streaming /api/status parser (iter_status_records).
+
+Feeds generated status payloads to the parser in chunks and checks that it yields
+the same records as json.loads, for every possible chunk boundary of a small payload
+and for compact and pretty-printed large ones, that records are yielded while the
+payload is still streaming, and that the memory it holds stays bounded by the chunk
+size instead of growing with the payload, and that parse_status streams with the
+default STATUS_JSON_BACKEND. Exits non-zero if a check fails.
+
+    python check_status_parser.py
+"""
+import json
+import sys
+import tempfile
+import tracemalloc
+
+from benchmark import load_agent
+
+CHUNK_SIZE = 65536
+
+def make_payload(parents, workers_per_parent, indent=None):
+    devices = []
+    workers = []
+    for index in range(parents):
+        device_id = f"dévice-{index:05d}"  # Multi-byte characters end up split between chunks
+        devices.append({"deviceId": device_id, "isAlive": index % 7 != 0, "origin": f"10.0.{index // 256}.{index % 256}:5555",
+                        "version": "0.9.1", "workerCount": workers_per_parent, "lastSeen": 1700000000123 + index})
+        for worker in range(workers_per_parent):
+            allocated = (index + worker) % 5 != 0
+            workers.append({"workerId": f"{device_id}-w{worker}", "isAllocated": allocated,
+                            "parentDeviceId": device_id if allocated else None, "username": f"acct{worker}",
+                            "stats": {"encounters": index * worker, "rate": 1.5e-3}})
+    status = {"version": 2, "uptime": 123456789, "devices": devices, "workers": workers, "load": [0.5, 1, -2]}
+    return json.dumps(status, indent=indent, ensure_ascii=False).encode()
+
+class Chunks:
+    """Iterates the payload in fixed size chunks and counts how many were read."""
+
+    def __init__(self, payload, size):
+        self.payload = payload
+        self.size = size
+        self.read = 0
+
+    def __iter__(self):
+        for offset in range(0, len(self.payload), self.size):
+            self.read += 1
+            yield self.payload[offset:offset + self.size]
+
+class StreamingResponse:
+    """requests.Response stand-in that only serves the body through iter_content()."""
+
+    def __init__(self, payload):
+        self.chunks = Chunks(payload, CHUNK_SIZE)
+
+    def iter_content(self, chunk_size):
+        return iter(self.chunks)
+
+    @property
+    def content(self):
+        raise AssertionError("the whole body was read")
+
+def fields(records):
+    return [(key, tuple(getattr(record, name) for name in record.__slots__)) for key, record in records]
+
+def parse(agent, payload, size):
+    return fields(agent.iter_status_records(Chunks(payload, size)))
+
+def expected_records(agent, payload):
+    data = json.loads(payload)
+    return fields([("devices", agent.parent_status(device)) for device in data["devices"]]
+                  + [("workers", agent.worker_status(worker)) for worker in data["workers"]])
+
+def every_boundary(agent):
+    payload = make_payload(3, 2, indent=1)
+    expected = expected_records(agent, payload)
+    for size in range(1, len(payload) + 1):
+        if parse(agent, payload, size) != expected:
+            return False
+    return True
+
+def same_records(agent, indent):
+    payload = make_payload(2000, 6, indent)
+    return parse(agent, payload, CHUNK_SIZE) == expected_records(agent, payload)
+
+def yields_early(agent, indent):
+    chunks = Chunks(make_payload(2000, 6, indent), CHUNK_SIZE)
+    next(agent.iter_status_records(chunks))
+    return chunks.read <= 2
+
+def bounded_memory(agent, indent):
+    payload = make_payload(10000, 6, indent)
+    tracemalloc.start()
+    try:
+        for _ in agent.iter_status_records(Chunks(payload, CHUNK_SIZE)):
+            pass
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # A decoded chunk is up to 4 bytes per character, the buffer holds about two of them
+    return peak < 16 * CHUNK_SIZE < len(payload) // 8
+
+def large_skipped_value(agent):
+    payload = json.dumps({"history": list(range(200000)), "devices": [{"deviceId": "p", "isAlive": True}],
+                          "workers": []}).encode()
+    return parse(agent, payload, 4096) == [("devices", ("p", True))]
+
+def default_backend_streams(agent):
+    payload = make_payload(2000, 6)
+    parent_devices, worker_devices = agent.parse_status(StreamingResponse(payload))
+    records = [("devices", record) for record in parent_devices.values()] + [("workers", record) for record in worker_devices.values()]
+    return fields(records) == expected_records(agent, payload)
+
+def truncated(agent):
+    payload = make_payload(10, 2)
+    try:
+        list(agent.iter_status_records(Chunks(payload[:-20], CHUNK_SIZE)))
+    except ValueError:
+        return True
+    return False
+
+def main():
+    agent = load_agent(tempfile.mkdtemp(prefix="cosmog-parser-"))
+    checks = [
+        ("every chunk boundary", lambda: every_boundary(agent)),
+        ("compact payload", lambda: same_records(agent, None)),
+        ("pretty-printed payload", lambda: same_records(agent, 2)),
+        ("first record after 2 chunks, compact", lambda: yields_early(agent, None)),
+        ("first record after 2 chunks, pretty-printed", lambda: yields_early(agent, 2)),
+        ("memory bounded by chunk size, compact", lambda: bounded_memory(agent, None)),
+        ("memory bounded by chunk size, pretty-printed", lambda: bounded_memory(agent, 2)),
+        ("skipped value spanning many chunks", lambda: large_skipped_value(agent)),
+        ("truncated payload raises", lambda: truncated(agent)),
+        ("parse_status streams by default", lambda: default_backend_streams(agent)),
+    ]
+    failed = 0
+    for name, check in checks:
+        try:
+            ok = check()
+            error = ""
+        except Exception as e:
+            ok = False
+            error = f" ({type(e).__name__}: {e})"
+        failed += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {name}{error}")
+    print(f"{failed} checks failed" if failed else "all checks passed")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
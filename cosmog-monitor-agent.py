@@ -1,4 +1,5 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import time
 import subprocess
@@ -6,18 +7,62 @@ import socket
 import os
 import logging
 import configparser
+import ipaddress
+import threading
+import struct
+import asyncio
+import functools
+import contextvars
+import codecs
+import re
+import random
+import sqlite3
+import bisect
+import math
+import statistics
+from array import array
+from contextlib import closing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import signal
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+current_site = contextvars.ContextVar('current_site', default=None)
+
+class SiteLogFilter(logging.Filter):
+    """Prefixes log messages with the name of the site they were logged for."""
+
+    def filter(self, record):
+        site = current_site.get()
+        if site and not getattr(record, 'site', None):
+            record.site = site
+            record.msg = f"[{site}] {record.msg}"
+        return True
+
+for handler in logging.getLogger().handlers:
+    handler.addFilter(SiteLogFilter())
+
 # Read configuration from config.ini
 config = configparser.ConfigParser()
 config.read('config.ini')
 
 # Configurations
 STATUS_URL = config['DEFAULT'].get('STATUS_URL', 'http://0.0.0.0:7072/api/status')
-TIMEOUT = config['DEFAULT'].getint('TIMEOUT', 1200)
+TIMEOUT = config['DEFAULT'].getint('TIMEOUT', 30)
 CHECK_INTERVAL = config['DEFAULT'].getint('CHECK_INTERVAL', 1800)
 PROBLEM_CHECK_INTERVAL = config['DEFAULT'].getint('PROBLEM_CHECK_INTERVAL', 90)
 MAX_WAIT_TIME = config['DEFAULT'].getint('MAX_WAIT_TIME', 3600)
@@ -25,21 +70,248 @@ HOST = config['DEFAULT'].get('HOST', '192.168.0.')
 PORT = config['DEFAULT'].getint('PORT', 5555)
 DEVICE_IP_FILE = config['DEFAULT'].get('DEVICE_IP_FILE', 'DeviceIP.txt')
 DEVICE_NAME_IP_FILE = config['DEFAULT'].get('DEVICE_NAME_IP_FILE', 'DeviceNameIP.txt')
+DEVICE_REGISTRY_FILE = config['DEFAULT'].get('DEVICE_REGISTRY_FILE', 'DeviceRegistry.db')
+REDISCOVERY_COOLDOWN = config['DEFAULT'].getint('REDISCOVERY_COOLDOWN', 300)
+HISTORY_FILE = config['DEFAULT'].get('HISTORY_FILE', 'FleetHistory.db')
+HISTORY_RETENTION_DAYS = config['DEFAULT'].getint('HISTORY_RETENTION_DAYS', 30)
+HISTORY_ROLLUP_RETENTION_DAYS = config['DEFAULT'].getint('HISTORY_ROLLUP_RETENTION_DAYS', 365)
 DISCORD_WEBHOOK = config['DEFAULT'].get('DISCORD_WEBHOOK', 'https://discord.com/api/webhooks/your_webhook_url_here')
 CONSECUTIVE_PROBLEM_THRESHOLD = config['DEFAULT'].getint('CONSECUTIVE_PROBLEM_THRESHOLD', 2)
 BUGGED_DEVICE_THRESHOLD = config['DEFAULT'].getint('BUGGED_DEVICE_THRESHOLD', 3)
 GRACE_PERIOD = config['DEFAULT'].getint('GRACE_PERIOD', 900)
+OFFLINE_THRESHOLD = config['DEFAULT'].getint('OFFLINE_THRESHOLD', 3)
+MAX_APP_RESTARTS = config['DEFAULT'].getint('MAX_APP_RESTARTS', 2)
+MAX_REBOOTS = config['DEFAULT'].getint('MAX_REBOOTS', 1)
+ESCALATION_BACKOFF = config['DEFAULT'].getint('ESCALATION_BACKOFF', 900)
+ESCALATION_BACKOFF_MAX = config['DEFAULT'].getint('ESCALATION_BACKOFF_MAX', 3600)
+QUARANTINE_TIME = config['DEFAULT'].getint('QUARANTINE_TIME', 21600)
+CIRCUIT_BREAKER_MAX_OFFLINE = config['DEFAULT'].getint('CIRCUIT_BREAKER_MAX_OFFLINE', 10)
+CIRCUIT_BREAKER_MAX_OFFLINE_RATIO = config['DEFAULT'].getfloat('CIRCUIT_BREAKER_MAX_OFFLINE_RATIO', 0.3)
+CIRCUIT_BREAKER_MAX_FAILURES = config['DEFAULT'].getint('CIRCUIT_BREAKER_MAX_FAILURES', 5)
+CIRCUIT_BREAKER_COOLDOWN = config['DEFAULT'].getint('CIRCUIT_BREAKER_COOLDOWN', 600)
+CIRCUIT_BREAKER_PROBES = config['DEFAULT'].getint('CIRCUIT_BREAKER_PROBES', 2)
+ANOMALY_WINDOW = config['DEFAULT'].getint('ANOMALY_WINDOW', 20)
+ANOMALY_MIN_SAMPLES = config['DEFAULT'].getint('ANOMALY_MIN_SAMPLES', 5)
+ANOMALY_Z_THRESHOLD = config['DEFAULT'].getfloat('ANOMALY_Z_THRESHOLD', 3.0)
+ANOMALY_MIN_DROP = config['DEFAULT'].getfloat('ANOMALY_MIN_DROP', 0.25)
+ANOMALY_MIN_STD = config['DEFAULT'].getfloat('ANOMALY_MIN_STD', 0.5)
+ANOMALY_BACKEND = config['DEFAULT'].get('ANOMALY_BACKEND', 'auto')
+SUBNETS = config['DEFAULT'].get('SUBNETS', '')
+SCAN_WORKERS = config['DEFAULT'].getint('SCAN_WORKERS', 64)
+FINGERPRINT_WORKERS = config['DEFAULT'].getint('FINGERPRINT_WORKERS', 8)
+CONNECT_TIMEOUT = config['DEFAULT'].getfloat('CONNECT_TIMEOUT', 0.5)
+REMEDIATION_WORKERS = config['DEFAULT'].getint('REMEDIATION_WORKERS', 4)
+ADB_HEALTH_CHECK_INTERVAL = config['DEFAULT'].getint('ADB_HEALTH_CHECK_INTERVAL', 60)
+ADB_COMMAND_TIMEOUT = config['DEFAULT'].getint('ADB_COMMAND_TIMEOUT', 30)
+ADB_BACKEND = config['DEFAULT'].get('ADB_BACKEND', 'native')
+ADB_SERVER_HOST = config['DEFAULT'].get('ADB_SERVER_HOST', '127.0.0.1')
+ADB_SERVER_PORT = config['DEFAULT'].getint('ADB_SERVER_PORT', 5037)
+STATUS_JSON_BACKEND = config['DEFAULT'].get('STATUS_JSON_BACKEND', 'stream')
+STATUS_RETRIES = config['DEFAULT'].getint('STATUS_RETRIES', 3)
+STATUS_BACKOFF = config['DEFAULT'].getfloat('STATUS_BACKOFF', 1.0)
+STATUS_BACKOFF_MAX = config['DEFAULT'].getfloat('STATUS_BACKOFF_MAX', 30.0)
+MIN_POLL_INTERVAL = config['DEFAULT'].getint('MIN_POLL_INTERVAL', PROBLEM_CHECK_INTERVAL)
+MAX_POLL_INTERVAL = config['DEFAULT'].getint('MAX_POLL_INTERVAL', CHECK_INTERVAL)
+POLL_BACKOFF_FACTOR = config['DEFAULT'].getfloat('POLL_BACKOFF_FACTOR', 2.0)
+DISCORD_EDIT_MESSAGE = config['DEFAULT'].getboolean('DISCORD_EDIT_MESSAGE', True)
+DISCORD_COALESCE_WINDOW = config['DEFAULT'].getfloat('DISCORD_COALESCE_WINDOW', 2.0)
+DISCORD_RETRY_INTERVAL = config['DEFAULT'].getint('DISCORD_RETRY_INTERVAL', 30)
+DISCORD_STATE_FILE = config['DEFAULT'].get('DISCORD_STATE_FILE', 'DiscordState.json')
+REBOOT_TIMEOUT = config['DEFAULT'].getint('REBOOT_TIMEOUT', 300)
+REBOOT_MIN_TIMEOUT = config['DEFAULT'].getint('REBOOT_MIN_TIMEOUT', 60)
+REBOOT_MAX_TIMEOUT = config['DEFAULT'].getint('REBOOT_MAX_TIMEOUT', 900)
+REBOOT_APP_TIMEOUT = config['DEFAULT'].getint('REBOOT_APP_TIMEOUT', 120)
+REBOOT_POLL_MIN = config['DEFAULT'].getfloat('REBOOT_POLL_MIN', 2.0)
+REBOOT_POLL_MAX = config['DEFAULT'].getfloat('REBOOT_POLL_MAX', 15.0)
+METRICS_HOST = config['DEFAULT'].get('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = config['DEFAULT'].getint('METRICS_PORT', 9464)
 
 # Global variables
-discord_message_id = None
 current_status = "Script Started"
 current_message = "Device monitoring script has started."
-consecutive_problem_count = 0  # Counter for consecutive checks below threshold
+
+shutting_down = threading.Event()  # Set when the agent stops, remediation jobs stop waiting on devices
+
+class Clock:
+    """Source of time for the monitor logic.
+
+    Grace periods, escalation backoffs, reboot deadlines and history timestamps all
+    read the module level clock, so the simulation harness (benchmark.py) can swap in
+    a virtual clock. Network timeouts and rate limits always use real time. Sleeps
+    end early when the agent is shutting down.
+    """
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def now(self):
+        return datetime.now()
+
+    def sleep(self, seconds):
+        shutting_down.wait(seconds)
+
+clock = Clock()
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+class Counter:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600)):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = {}  # labels -> [count per bucket..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in self._values.items()]
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {counts[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    """Prometheus text format metrics served on METRICS_HOST:METRICS_PORT/metrics.
+
+    Counters and histograms are plain in-memory updates on the hot path. Gauges are
+    read from collector callbacks only when /metrics is scraped, so nothing is computed
+    when nobody is scraping.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []  # callables returning [(name, documentation, {labels tuple: value})]
+
+    def counter(self, name, documentation):
+        metric = Counter(name, documentation)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, **kwargs):
+        metric = Histogram(name, documentation, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        gauges = {}  # name -> (documentation, values), collectors of several sites share names
+        for collector in self.collectors:
+            try:
+                collected = collector()
+            except Exception as e:
+                logging.error(f"Metrics collector failed: {e}")
+                continue
+            for name, documentation, values in collected:
+                gauges.setdefault(name, (documentation, {}))[1].update(values)
+        for name, (documentation, values) in gauges.items():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            for key, value in values.items():
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, host=METRICS_HOST, port=METRICS_PORT):
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Don't log every scrape
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+        return server
+
+metrics = MetricsRegistry()
+operation_duration = metrics.histogram("cosmog_operation_duration_seconds", "Duration of agent operations in seconds.")
+restarts_total = metrics.counter("cosmog_restarts_total", "Cosmog app restarts per device and result.")
+reboots_total = metrics.counter("cosmog_reboots_total", "Device reboots per device and result.")
+webhook_failures_total = metrics.counter("cosmog_webhook_failures_total", "Failed Discord webhook deliveries.")
+
+def timed(operation):
+    """Record the duration of every call in cosmog_operation_duration_seconds."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                operation_duration.observe(time.perf_counter() - start, operation=operation)
+        return wrapper
+    return decorator
+
+def start_metrics_server():
+    if METRICS_PORT <= 0:
+        return None
+    try:
+        return metrics.serve()
+    except OSError as e:
+        logging.error(f"Could not start metrics server on {METRICS_HOST}:{METRICS_PORT}: {e}")
+        return None
 
 def is_port_open(host, port):
     s = socket.socket()
     try:
-        s.settimeout(0.5)
+        s.settimeout(CONNECT_TIMEOUT)
         s.connect((host, port))
     except:
         return False
@@ -47,76 +319,627 @@ def is_port_open(host, port):
         s.close()
         return True
 
-def get_file_modification_time(filename):
-    try:
-        return os.path.getmtime(filename)
-    except FileNotFoundError:
-        return 0
-
-def write_devicename(hostport):
-    subprocess.call("adb connect " + str(hostport), shell=True)
-    time.sleep(1)  # Introduce a delay after connecting to ensure the device is ready
-
-    cosmog_config_path = "cosmog.json"
-    old_mod_time = get_file_modification_time(cosmog_config_path)
-
+COSMOG_CONFIG_PATH = "/data/local/tmp/cosmog.json"
+COSMOG_FORCE_STOP = "am force-stop com.sy1vi3.cosmog"
+COSMOG_START = "am start -n com.sy1vi3.cosmog/com.sy1vi3.cosmog.MainActivity"
+
+# adb error output that means the session to the device is gone and needs a reconnect
+ADB_SESSION_ERRORS = ("not found", "offline", "unauthorized", "closed", "no devices", "cannot connect")
+
+class AdbError(Exception):
+    pass
+
+class SubprocessAdb:
+    """adb backend that runs the adb binary for every command."""
+
+    def __init__(self, timeout=ADB_COMMAND_TIMEOUT):
+        self.timeout = timeout
+
+    def _adb(self, args, timeout=None, text=True):
+        return subprocess.run(["adb"] + args, capture_output=True, text=text, timeout=timeout or self.timeout)
+
+    def connect(self, serial):
+        # adb connect exits 0 even when it fails, the outcome is only in the output
+        result = self._adb(["connect", serial])
+        return (result.stdout + result.stderr).strip()
+
+    def disconnect(self, serial):
+        self._adb(["disconnect", serial])
+
+    def get_state(self, serial):
+        result = self._adb(["-s", serial, "get-state"])
+        if result.returncode != 0:
+            raise AdbError(result.stderr.strip())
+        return result.stdout.strip()
+
+    def shell(self, serial, command, timeout=None):
+        result = self._adb(["-s", serial, "shell", command], timeout)
+        if result.returncode != 0 and result.stderr.startswith("error:"):
+            raise AdbError(result.stderr.strip())
+        return result.returncode, result.stdout + result.stderr
+
+    def pull(self, serial, path, timeout=None):
+        result = self._adb(["-s", serial, "exec-out", "cat", path], timeout, text=False)
+        if result.returncode != 0:
+            raise AdbError(result.stderr.decode(errors="replace").strip())
+        return result.stdout
+
+    def reboot(self, serial):
+        result = self._adb(["-s", serial, "reboot"])
+        if result.returncode != 0:
+            raise AdbError(result.stderr.strip())
+
+class AdbClient:
+    """In-process client for the local adb server's host protocol.
+
+    Talks to the adb server on ADB_SERVER_HOST:ADB_SERVER_PORT directly instead of
+    spawning the adb binary. Every request opens its own socket, so one client can be
+    shared between threads, and the *_async methods run requests from asyncio code.
+    """
+
+    def __init__(self, host=ADB_SERVER_HOST, port=ADB_SERVER_PORT, timeout=ADB_COMMAND_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._server_started = False
+
+    def _open(self, timeout=None):
+        try:
+            return socket.create_connection((self.host, self.port), timeout=timeout or self.timeout)
+        except ConnectionRefusedError:
+            if self._server_started:
+                raise
+            # Same as the adb binary: start the server on first use if it isn't running
+            logging.info("adb server not running, starting it.")
+            subprocess.run(["adb", "start-server"], capture_output=True, timeout=self.timeout)
+            self._server_started = True
+            return socket.create_connection((self.host, self.port), timeout=timeout or self.timeout)
+
+    @staticmethod
+    def _recv_exactly(sock, size):
+        data = b""
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise AdbError("adb server closed the connection")
+            data += chunk
+        return data
+
+    @staticmethod
+    def _recv_all(sock):
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+
+    def _recv_string(self, sock):
+        size = int(self._recv_exactly(sock, 4), 16)
+        return self._recv_exactly(sock, size).decode(errors="replace")
+
+    def _request(self, sock, service):
+        payload = service.encode()
+        sock.sendall(b"%04x" % len(payload) + payload)
+        status = self._recv_exactly(sock, 4)
+        if status == b"FAIL":
+            raise AdbError(self._recv_string(sock))
+        if status != b"OKAY":
+            raise AdbError(f"Unexpected response {status!r} to {service}")
+
+    def _host_query(self, service):
+        with self._open() as sock:
+            self._request(sock, service)
+            return self._recv_string(sock)
+
+    def _transport(self, serial, timeout=None):
+        sock = self._open(timeout)
+        try:
+            self._request(sock, f"host:transport:{serial}")
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def connect(self, serial):
+        return self._host_query(f"host:connect:{serial}")
+
+    def disconnect(self, serial):
+        return self._host_query(f"host:disconnect:{serial}")
+
+    def get_state(self, serial):
+        return self._host_query(f"host-serial:{serial}:get-state")
+
+    def shell(self, serial, command, timeout=None):
+        # The v1 shell service doesn't report exit codes, so echo it after the output
+        with self._transport(serial, timeout) as sock:
+            self._request(sock, f"shell:{command} ; echo :$?")
+            output = self._recv_all(sock).decode(errors="replace")
+        output, _, returncode = output.rstrip().rpartition(":")
+        try:
+            return int(returncode), output
+        except ValueError:
+            raise AdbError(f"Shell command on {serial} ended without an exit code")
+
+    def pull(self, serial, path, timeout=None):
+        with self._transport(serial, timeout) as sock:
+            self._request(sock, "sync:")
+            encoded_path = path.encode()
+            sock.sendall(b"RECV" + struct.pack("<I", len(encoded_path)) + encoded_path)
+            chunks = []
+            while True:
+                chunk_id, size = struct.unpack("<4sI", self._recv_exactly(sock, 8))
+                if chunk_id == b"DATA":
+                    chunks.append(self._recv_exactly(sock, size))
+                elif chunk_id == b"DONE":
+                    break
+                elif chunk_id == b"FAIL":
+                    raise AdbError(self._recv_exactly(sock, size).decode(errors="replace"))
+                else:
+                    raise AdbError(f"Unexpected sync response {chunk_id!r} while pulling {path}")
+            sock.sendall(b"QUIT" + struct.pack("<I", 0))
+            return b"".join(chunks)
+
+    def reboot(self, serial):
+        with self._transport(serial) as sock:
+            self._request(sock, "reboot:")
+            self._recv_all(sock)
+
+    async def _run_async(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+    async def connect_async(self, serial):
+        return await self._run_async(self.connect, serial)
+
+    async def shell_async(self, serial, command, timeout=None):
+        return await self._run_async(self.shell, serial, command, timeout=timeout)
+
+    async def pull_async(self, serial, path, timeout=None):
+        return await self._run_async(self.pull, serial, path, timeout=timeout)
+
+    async def reboot_async(self, serial):
+        return await self._run_async(self.reboot, serial)
+
+def create_adb_backend():
+    if ADB_BACKEND == "subprocess":
+        return SubprocessAdb()
+    if ADB_BACKEND != "native":
+        logging.warning(f"Unknown ADB_BACKEND {ADB_BACKEND}, using native.")
+    return AdbClient()
+
+class AdbSessionPool:
+    """Keeps `adb connect` sessions to the devices open between commands.
+
+    Sessions are only health checked when a command is about to use them and the last
+    successful command is older than ADB_HEALTH_CHECK_INTERVAL, and a device is only
+    reconnected when the check or the command itself shows the session is gone.
+    """
+
+    def __init__(self, backend=None, health_check_interval=ADB_HEALTH_CHECK_INTERVAL):
+        self.backend = backend or create_adb_backend()
+        self.health_check_interval = health_check_interval
+        self._lock = threading.Lock()
+        self._last_ok = {}  # serial -> time.monotonic() of the last successful command
+        self._serial_locks = {}
+
+    def _serial_lock(self, serial):
+        with self._lock:
+            return self._serial_locks.setdefault(serial, threading.Lock())
+
+    def connect(self, serial):
+        with self._serial_lock(serial):
+            try:
+                message = self.backend.connect(serial)
+            except (AdbError, subprocess.SubprocessError, OSError) as e:
+                message = str(e)
+            if "connected to" in message:
+                self._last_ok[serial] = time.monotonic()
+                return True
+            self._last_ok.pop(serial, None)
+            logging.warning(f"Could not connect to {serial}: {message}")
+            return False
+
+    def connect_all(self, serials):
+        serials = list(serials)
+        if not serials:
+            return 0
+        with ThreadPoolExecutor(max_workers=min(len(serials), FINGERPRINT_WORKERS)) as pool:
+            connected = sum(pool.map(self.connect, serials))
+        logging.info(f"Opened adb sessions to {connected}/{len(serials)} devices.")
+        return connected
+
+    def ensure(self, serial):
+        last_ok = self._last_ok.get(serial)
+        if last_ok is not None and time.monotonic() - last_ok < self.health_check_interval:
+            return True
+        if last_ok is not None:
+            try:
+                if self.backend.get_state(serial) == "device":
+                    self._last_ok[serial] = time.monotonic()
+                    return True
+            except AdbError:
+                pass
+        return self.connect(serial)
+
+    def invalidate(self, serial):
+        self._last_ok.pop(serial, None)
+
+    def _call(self, serial, func, *args, **kwargs):
+        """Run a backend command, reconnecting and retrying once if the session was lost."""
+        self.ensure(serial)
+        try:
+            result = func(serial, *args, **kwargs)
+        except AdbError as e:
+            if not any(err in str(e).lower() for err in ADB_SESSION_ERRORS):
+                raise
+            logging.info(f"adb session to {serial} lost, reconnecting.")
+            self.invalidate(serial)
+            if not self.connect(serial):
+                raise
+            result = func(serial, *args, **kwargs)
+        self._last_ok[serial] = time.monotonic()
+        return result
+
+    def shell(self, serial, *commands, timeout=None):
+        """Run several shell commands on the device in a single shell session.
+
+        Returns a (returncode, output) tuple for the last command.
+        """
+        return self._call(serial, self.backend.shell, " ; ".join(commands), timeout=timeout)
+
+    def pull(self, serial, path, timeout=None):
+        return self._call(serial, self.backend.pull, path, timeout=timeout)
+
+    def reboot(self, serial):
+        self._call(serial, self.backend.reboot)
+        self.invalidate(serial)
+
+    def disconnect(self, serial):
+        # Only drop this device, a bare `adb disconnect` would drop every session
+        self.invalidate(serial)
+        try:
+            self.backend.disconnect(serial)
+        except (AdbError, subprocess.SubprocessError, OSError) as e:
+            logging.debug(f"Failed to disconnect {serial}: {e}")
+
+adb_pool = AdbSessionPool()
+
+def fingerprint_device(hostport):
+    """Connect to hostport over adb and read the device_id from its cosmog.json.
+
+    The config is read into memory rather than pulled into a shared local file, so
+    several hosts can be fingerprinted at the same time.
+    """
     timeout_duration = 10  # Timeout after 10 seconds
-
     try:
-        subprocess.call(f"adb -s {hostport} pull /data/local/tmp/{cosmog_config_path}", shell=True,
-                        timeout=timeout_duration)
-        new_mod_time = get_file_modification_time(cosmog_config_path)
-
-        if new_mod_time > old_mod_time:
+        content = adb_pool.pull(hostport, COSMOG_CONFIG_PATH, timeout=timeout_duration)
+        if not content.strip():
+            logging.error(f"{COSMOG_CONFIG_PATH} is empty on {hostport}.")
+            return None
+        return json.loads(content)['device_id']
+    except (subprocess.TimeoutExpired, socket.timeout):
+        logging.error(f"Timeout expired while reading {COSMOG_CONFIG_PATH} from {hostport}.")
+    except (json.JSONDecodeError, UnicodeDecodeError, KeyError, TypeError):
+        logging.error(f"Could not decode device_id from {COSMOG_CONFIG_PATH} for {hostport}.")
+    except Exception as e:
+        logging.error(f"Failed to read {COSMOG_CONFIG_PATH} from {hostport}: {e}")
+    return None
+
+class DeviceRegistry:
+    """deviceId <-> ip:port index backed by a SQLite database.
+
+    Lookups are served from in-memory dicts. The database is only read again when its
+    mtime changes (e.g. after a discovery run in another process), and every write is
+    a single transaction. Each device has one address and each address one device, so
+    rediscovering a device updates its entry instead of adding a duplicate. The first
+    and last time every device was seen are kept alongside.
+
+    DEVICE_NAME_IP_FILE is imported on first use, and it and DEVICE_IP_FILE are kept
+    up to date as plain text exports for other tools.
+    """
+
+    def __init__(self, path=DEVICE_REGISTRY_FILE, legacy_file=DEVICE_NAME_IP_FILE, ip_file=DEVICE_IP_FILE):
+        self.path = path
+        self.legacy_file = legacy_file
+        self.ip_file = ip_file
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._by_device = {}  # device_id -> ip:port
+        self._by_address = {}  # ip:port -> device_id
+        self._seen = {}  # device_id -> (first_seen, last_seen)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        db.execute("CREATE TABLE IF NOT EXISTS devices ("
+                   "device_id TEXT PRIMARY KEY, address TEXT NOT NULL UNIQUE, "
+                   "first_seen REAL NOT NULL, last_seen REAL NOT NULL)")
+        return db
+
+    def load(self):
+        with self._lock:
+            with closing(self._connect()) as db:
+                rows = db.execute("SELECT device_id, address, first_seen, last_seen FROM devices").fetchall()
+            if not rows and os.path.exists(self.legacy_file):
+                rows = self._import_legacy_file()
+            # Swap in whole new dicts so lookups from other threads never see a partial index
+            self._by_device = {device_id: address for device_id, address, _, _ in rows}
+            self._by_address = {address: device_id for device_id, address, _, _ in rows}
+            self._seen = {device_id: (first_seen, last_seen) for device_id, _, first_seen, last_seen in rows}
+            self._mtime = os.path.getmtime(self.path)
+        if not rows:
+            logging.warning(f"No devices in {self.path}. Make sure device discovery has been run.")
+        return len(rows)
+
+    def refresh(self):
+        """Reload the index if the database was changed since it was last read."""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except FileNotFoundError:
+            mtime = None
+        if mtime != self._mtime:
+            self.load()
+
+    def _import_legacy_file(self):
+        entries = {}
+        with open(self.legacy_file) as file:
+            for line in file:
+                # ip:port never contains '=', the device name may
+                address, sep, device_id = line.strip().partition('=')
+                if sep and device_id:
+                    entries[device_id] = address
+        logging.info(f"Importing {len(entries)} devices from {self.legacy_file}")
+        self._write(entries.items(), clock.time())
+        with closing(self._connect()) as db:
+            return db.execute("SELECT device_id, address, first_seen, last_seen FROM devices").fetchall()
+
+    def _write(self, pairs, seen):
+        with closing(self._connect()) as db, db:
+            for device_id, address in pairs:
+                # An address belongs to one device, drop whoever had it before
+                db.execute("DELETE FROM devices WHERE address = ? AND device_id != ?", (address, device_id))
+                db.execute("INSERT INTO devices (device_id, address, first_seen, last_seen) VALUES (?, ?, ?, ?) "
+                           "ON CONFLICT(device_id) DO UPDATE SET address = excluded.address, last_seen = excluded.last_seen",
+                           (device_id, address, seen, seen))
+
+    def record(self, pairs):
+        """Store (device_id, ip:port) pairs seen now and update the index."""
+        pairs = list(pairs)
+        if not pairs:
+            return
+        self.refresh()
+        seen = clock.time()
+        with self._lock:
+            self._write(pairs, seen)
+            by_device = dict(self._by_device)
+            by_address = dict(self._by_address)
+            seen_times = dict(self._seen)
+            for device_id, address in pairs:
+                old_address = by_device.get(device_id)
+                if old_address is not None and by_address.get(old_address) == device_id:
+                    del by_address[old_address]
+                old_device = by_address.get(address)
+                if old_device is not None and old_device != device_id:
+                    by_device.pop(old_device, None)
+                    seen_times.pop(old_device, None)
+                by_device[device_id] = address
+                by_address[address] = device_id
+                seen_times[device_id] = (seen_times.get(device_id, (seen, seen))[0], seen)
+            self._by_device, self._by_address, self._seen = by_device, by_address, seen_times
+            # Our own write must not trigger a reload
+            self._mtime = os.path.getmtime(self.path)
+        self.export_legacy_file()
+
+    def export_legacy_file(self):
+        entries = sorted(self._by_device.items(), key=lambda item: item[1])
+        with open(self.legacy_file + ".tmp", "w") as x, open(self.ip_file + ".tmp", "w") as f:
+            for device_id, address in entries:
+                x.write(f"{address}={device_id}\n")
+                f.write(f"{address}\n")
+        os.replace(self.legacy_file + ".tmp", self.legacy_file)
+        os.replace(self.ip_file + ".tmp", self.ip_file)
+
+    def address_of(self, device_id):
+        return self._by_device.get(device_id)
+
+    def device_at(self, address):
+        return self._by_address.get(address)
+
+    def seen(self, device_id):
+        return self._seen.get(device_id)
+
+    def devices(self):
+        return dict(self._by_device)
+
+    def __contains__(self, device_id):
+        return device_id in self._by_device
+
+    def __len__(self):
+        return len(self._by_device)
+
+registry = DeviceRegistry()
+
+def get_connected_devices(registry=registry):
+    registry.refresh()
+    return registry.devices()
+
+class DiscordNotifier:
+    """Background Discord webhook pipeline.
+
+    Status updates submitted while a send is pending or rate limited are coalesced
+    into a single embed. With DISCORD_EDIT_MESSAGE the embed is edited into one status
+    message (message_id) instead of posting a new message every time. Discord's
+    rate limit headers and 429 Retry-After are honoured, and updates that can't be
+    delivered are spooled to DISCORD_STATE_FILE until the webhook is reachable again.
+    """
+
+    max_pending = 50
+
+    def __init__(self, webhook=DISCORD_WEBHOOK, state_file=DISCORD_STATE_FILE,
+                 edit_message=DISCORD_EDIT_MESSAGE, coalesce_window=DISCORD_COALESCE_WINDOW):
+        self.webhook = webhook
+        self.state_file = state_file
+        self.edit_message = edit_message
+        self.coalesce_window = coalesce_window
+        self.session = requests.Session()
+        self.message_id = None  # Status message that gets edited
+        self.pending = []  # (status, message, timestamp) not delivered yet
+        self.loop = None
+        self._wakeup = None
+        self._rate_limited_until = {}  # "POST"/"PATCH" -> time.monotonic() the route is usable again
+        self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not read {self.state_file}: {e}")
+            return
+        self.message_id = state.get('message_id')
+        self.pending = [tuple(entry) for entry in state.get('spool', [])]
+
+    def _save_state(self):
+        tmp_file = self.state_file + ".tmp"
+        try:
+            with open(tmp_file, "w") as f:
+                json.dump({'message_id': self.message_id, 'spool': self.pending}, f)
+            os.replace(tmp_file, self.state_file)
+        except OSError as e:
+            logging.error(f"Could not write {self.state_file}: {e}")
+
+    def submit(self, status, message):
+        """Queue a status update. Safe to call from any thread."""
+        entry = (status, message, datetime.utcnow().isoformat())
+        if self.loop is None:
+            # Pipeline not running (startup/shutdown), send right away
+            self.pending.append(entry)
+            self.flush()
+        else:
+            self.loop.call_soon_threadsafe(self._enqueue, entry)
+
+    def _enqueue(self, entry):
+        self.pending.append(entry)
+        self._wakeup.set()
+
+    def build_payload(self, entries):
+        status, _, timestamp = entries[-1]
+        # Newest update last, Discord caps embed descriptions at 4096 characters
+        description = "\n".join(message for _, message, _ in entries)[-4096:]
+        embed = {
+            "title": "Device Status Update",
+            "description": description,
+            "color": get_status_color(status),
+            "timestamp": timestamp
+        }
+        return {"embeds": [embed]}
+
+    def _update_rate_limit(self, route, response):
+        retry_after = None
+        if response.status_code == 429:
             try:
-                with open(cosmog_config_path) as jsonFile:
-                    jsonObject = json.load(jsonFile)
-                devicename = "=" + jsonObject['device_id']
-                with open(DEVICE_NAME_IP_FILE, "a") as x:
-                    x.write(hostport + devicename + "\n")
-                return True
-            except json.JSONDecodeError:
-                logging.error(f"Could not decode JSON from {cosmog_config_path} for {hostport}.")
+                retry_after = float(response.headers.get("Retry-After") or response.json().get("retry_after", 1))
+            except ValueError:
+                retry_after = 1.0
+        elif response.headers.get("X-RateLimit-Remaining") == "0":
+            retry_after = float(response.headers.get("X-RateLimit-Reset-After", 1))
+        if retry_after is not None:
+            until = time.monotonic() + retry_after
+            routes = ("POST", "PATCH") if response.headers.get("X-RateLimit-Global") else (route,)
+            for limited_route in routes:
+                self._rate_limited_until[limited_route] = until
+        return retry_after
+
+    @timed("send_discord_embed")
+    def deliver(self, entries):
+        """Send one coalesced embed. Returns (delivered, seconds to wait before retrying)."""
+        if self.message_id and self.edit_message:
+            route, url = "PATCH", f"{self.webhook}/messages/{self.message_id}"
         else:
-            logging.error(f"{cosmog_config_path} has not been updated for {hostport}.")
-    except subprocess.TimeoutExpired:
-        logging.error(f"Timeout expired while pulling {cosmog_config_path} for {hostport}.")
-    except Exception as e:
-        logging.error(f"Failed to pull {cosmog_config_path} for {hostport}: {e}")
-    return False
+            route, url = "POST", f"{self.webhook}?wait=true"
+
+        wait = self._rate_limited_until.get(route, 0) - time.monotonic()
+        if wait > 0:
+            return False, wait
+
+        try:
+            response = self.session.request(route, url, json=self.build_payload(entries), timeout=10)
+        except requests.RequestException as e:
+            logging.error(f"Failed to send Discord embed: {e}")
+            webhook_failures_total.inc(reason="unreachable")
+            return False, None
+
+        retry_after = self._update_rate_limit(route, response)
+        if response.status_code == 429:
+            logging.warning(f"Discord rate limited the webhook, retrying in {retry_after:.1f}s")
+            webhook_failures_total.inc(reason="rate_limited")
+            return False, retry_after
+        if route == "PATCH" and response.status_code == 404:
+            logging.warning("Discord status message was deleted, posting a new one.")
+            self.message_id = None
+            return False, 0
+        if response.status_code >= 500:
+            logging.error(f"Failed to send Discord embed: HTTP {response.status_code}")
+            webhook_failures_total.inc(reason="server_error")
+            return False, None
+        if response.status_code >= 400:
+            # Retrying a rejected payload would fail the same way, drop it
+            logging.error(f"Discord rejected embed: HTTP {response.status_code} {response.text}")
+            webhook_failures_total.inc(reason="rejected")
+            return True, None
+
+        if route == "POST" and self.edit_message:
+            try:
+                self.message_id = response.json().get('id')
+            except ValueError:
+                self.message_id = None
+        logging.info("Discord embed sent successfully.")
+        return True, None
+
+    def flush(self, max_wait=5):
+        """Synchronously deliver everything pending, spooling it to disk if that fails."""
+        entries = list(self.pending)
+        while entries:
+            delivered, retry_after = self.deliver(entries)
+            if delivered:
+                del self.pending[:len(entries)]
+                break
+            if retry_after is None or retry_after > max_wait:
+                break
+            time.sleep(retry_after)
+        self._save_state()
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        if self.pending:
+            self._wakeup.set()  # Replay updates spooled by a previous run
+        try:
+            while True:
+                await self._wakeup.wait()
+                await asyncio.sleep(self.coalesce_window)  # Let bursts pile up into one embed
+                self._wakeup.clear()
+
+                del self.pending[:-self.max_pending]
+                entries = list(self.pending)
+                delivered, retry_after = await self.loop.run_in_executor(None, self.deliver, entries)
+                if delivered:
+                    del self.pending[:len(entries)]
+                else:
+                    if retry_after is None:
+                        retry_after = DISCORD_RETRY_INTERVAL
+                    await asyncio.sleep(retry_after)
+                    self._wakeup.set()
+                self._save_state()
+        finally:
+            self.loop = None
 
-def get_connected_devices():
-    try:
-        with open(DEVICE_NAME_IP_FILE, "r") as file:
-            return {line.split('=')[1].strip(): line.split('=')[0] for line in file.read().splitlines()}
-    except FileNotFoundError:
-        logging.error(f"{DEVICE_NAME_IP_FILE} not found. Make sure the discovery script has been run.")
-        return {}
+notifier = DiscordNotifier()
 
 def send_discord_embed():
-    global discord_message_id, current_status, current_message
-
-    embed = {
-        "title": "Device Status Update",
-        "description": current_message,
-        "color": get_status_color(current_status),
-        "timestamp": datetime.utcnow().isoformat()
-    }
-
-    data = {
-        "embeds": [embed]
-    }
-
-    headers = {
-        "Content-Type": "application/json"
-    }
-
-    try:
-        response = requests.post(DISCORD_WEBHOOK, json=data, headers=headers)
-        response.raise_for_status()
-        logging.info("Discord embed sent successfully.")
-    except requests.RequestException as e:
-        logging.error(f"Failed to send Discord embed: {e}")
+    notifier.submit(current_status, current_message)
 
 def get_status_color(status):
     status_colors = {
@@ -138,335 +961,1851 @@ def get_status_color(status):
     }
     return status_colors.get(status, 0x808080)  # Default to grey if status not found
 
-def restart_cosmog_app(device_ip, device_id, grace_period_devices):
+class DeviceUnreachable(Exception):
+    """Raised by remediation jobs when nothing answers on the device's registered address.
+
+    The device may have moved to a new DHCP address, the monitor rediscovers it.
+    """
+
+def is_reachable(device_ip):
+    host, port = device_ip.rsplit(':', 1)
+    return is_port_open(host, int(port))
+
+@timed("restart_cosmog_app")
+def restart_cosmog_app(device_ip, device_id):
     logging.info(f"Restarting Cosmog app on device {device_id}")
     try:
-        subprocess.run(f"adb disconnect", shell=True)
-        subprocess.run(f"adb connect {device_ip}", shell=True)
-        subprocess.run(f'adb -s {device_ip} shell "am force-stop com.sy1vi3.cosmog"', shell=True)
-        subprocess.run(f'adb -s {device_ip} shell "am start -n com.sy1vi3.cosmog/com.sy1vi3.cosmog.MainActivity"', shell=True)
-        subprocess.run(f"adb disconnect", shell=True)
+        returncode, output = adb_pool.shell(device_ip, COSMOG_FORCE_STOP, COSMOG_START)
+        if returncode != 0:
+            logging.error(f"Failed to restart Cosmog app on device {device_id}: {output.strip()}")
+            return False
         logging.info(f"Cosmog app restarted on device {device_id}")
-        # Start grace period after starting the app
-        grace_period_devices[device_id] = datetime.now()
-    except subprocess.CalledProcessError as e:
+        return True
+    except (AdbError, subprocess.SubprocessError, OSError) as e:
+        if not is_reachable(device_ip):
+            raise DeviceUnreachable(f"nothing answers on {device_ip} ({e})") from e
         logging.error(f"Failed to restart Cosmog app on device {device_id}: {e}")
+        return False
 
-def reboot_and_start_device(device_ip, device_id, grace_period_devices):
-    global current_status, current_message
+class BootStats:
+    """Per-device boot time statistics used to size reboot timeouts.
+
+    Keeps an exponentially weighted mean and variance of the time from the reboot
+    command to sys.boot_completed for every device, persisted with the monitor
+    counters. Once a device has booted a few times its timeout is the mean plus four
+    standard deviations, clamped to REBOOT_MIN_TIMEOUT..REBOOT_MAX_TIMEOUT.
+    """
+
+    alpha = 0.3
+    min_samples = 3
+
+    def __init__(self, history):
+        self.history = history
+        self._lock = threading.Lock()
+        self._stats = None  # device_id -> [mean, variance, samples]
+
+    def _load(self):
+        if self._stats is None:
+            self._stats = self.history.load_counters().get('boot_stats', {})
+        return self._stats
+
+    def timeout(self, device_id):
+        with self._lock:
+            stats = self._load().get(device_id)
+        if not stats or stats[2] < self.min_samples:
+            return REBOOT_TIMEOUT
+        mean, variance, _ = stats
+        return min(REBOOT_MAX_TIMEOUT, max(REBOOT_MIN_TIMEOUT, mean + 4 * math.sqrt(variance)))
+
+    def record(self, device_id, seconds):
+        with self._lock:
+            stats = self._load()
+            if device_id not in stats:
+                stats[device_id] = [seconds, 0.0, 1]
+            else:
+                mean, variance, samples = stats[device_id]
+                diff = seconds - mean
+                mean += self.alpha * diff
+                variance = (1 - self.alpha) * (variance + self.alpha * diff * diff)
+                stats[device_id] = [mean, variance, samples + 1]
+            self.history.save_counters({'boot_stats': stats})
+
+class RemediationCancelled(Exception):
+    pass
+
+def wait_until(check, deadline):
+    """Call check with exponential backoff until it returns True or deadline (clock.monotonic()) passes.
+
+    Raises RemediationCancelled when the agent is shutting down.
+    """
+    delay = REBOOT_POLL_MIN
+    while True:
+        if shutting_down.is_set():
+            raise RemediationCancelled("agent is shutting down")
+        if check():
+            return True
+        remaining = deadline - clock.monotonic()
+        if remaining <= 0:
+            return False
+        clock.sleep(min(delay, remaining))
+        delay = min(REBOOT_POLL_MAX, delay * 1.5)
+
+def shell_succeeds(device_ip, command, expected_output=None):
+    try:
+        returncode, output = adb_pool.shell(device_ip, command, timeout=10)
+    except (AdbError, subprocess.SubprocessError, OSError):
+        return False
+    return returncode == 0 and (expected_output is None or output.strip() == expected_output)
+
+@timed("reboot_and_start_device")
+def reboot_and_start_device(device_ip, device_id, is_registered=None, site=None):
+    """Reboot a device, wait until it is ready and start the Cosmog app.
+
+    Readiness is detected instead of waited out: the adb port has to accept
+    connections, sys.boot_completed has to be set and, after starting the app, the
+    Cosmog process has to be running. is_registered can be passed to also wait for
+    the device to show up as alive in /api/status. The job returns as soon as all
+    of this is true, so the grace period starts once the app is actually up.
+    Alerts and boot times go to the site's notifier and history.
+    """
+    site = site or default_site
     logging.info(f"Rebooting device {device_id}")
-
-    current_status = "Bugged"
-    current_message = f"🔧 Rebooting bugged device {device_id}..."
-    send_discord_embed()
+    site.notifier.submit("Bugged", f"🔧 Rebooting bugged device {device_id}...")
+    host, port = device_ip.rsplit(':', 1)
+    timeout = site.boot_stats.timeout(device_id)
 
     try:
         # Reboot device
-        subprocess.run(f"adb -s {device_ip} reboot", shell=True, check=True)
-        logging.info(f"Device {device_id} reboot command sent.")
-
-        # Wait for device to reboot and become available
-        time.sleep(120)  # Wait 2 minutes for reboot. Adjust as needed.
-
-        # Try to reconnect to the device
-        max_attempts = 10
-        for attempt in range(max_attempts):
-            time.sleep(10)  # Wait 10 seconds between attempts
-            result = subprocess.run(f"adb connect {device_ip}", shell=True, capture_output=True, text=True)
-            if "connected" in result.stdout or "already connected" in result.stdout:
-                logging.info(f"Device {device_id} reconnected after reboot.")
-                break
-            else:
-                logging.info(f"Attempt {attempt + 1}/{max_attempts}: Could not reconnect to device {device_id}.")
-        else:
-            logging.error(f"Failed to reconnect to device {device_id} after reboot.")
-            return
+        adb_pool.reboot(device_ip)
+        start = clock.monotonic()
+        deadline = start + timeout
+        logging.info(f"Device {device_id} reboot command sent, waiting up to {timeout:.0f}s for it to boot.")
+
+        # adbd keeps accepting connections for a moment after the reboot command
+        wait_until(lambda: not is_port_open(host, int(port)), min(deadline, start + 30))
+
+        if not wait_until(lambda: is_port_open(host, int(port)), deadline):
+            # Devices often get a new DHCP lease when they boot
+            raise DeviceUnreachable(f"device did not come back on {device_ip} after reboot")
+        if not wait_until(lambda: adb_pool.connect(device_ip) and
+                          shell_succeeds(device_ip, "getprop sys.boot_completed", "1"), deadline):
+            logging.error(f"Device {device_id} did not finish booting within {timeout:.0f}s.")
+            return False
+        boot_time = clock.monotonic() - start
+        site.boot_stats.record(device_id, boot_time)
+        logging.info(f"Device {device_id} booted in {boot_time:.0f}s.")
 
         # Start the Cosmog app
-        subprocess.run(f'adb -s {device_ip} shell "am start -n com.sy1vi3.cosmog/com.sy1vi3.cosmog.MainActivity"', shell=True, check=True)
-        logging.info(f"Started Cosmog app on device {device_id}.")
-
-        # Start grace period after starting the app
-        grace_period_devices[device_id] = datetime.now()
+        returncode, output = adb_pool.shell(device_ip, COSMOG_START)
+        if returncode != 0:
+            logging.error(f"Failed to start Cosmog app on device {device_id}: {output.strip()}")
+            return False
+
+        app_deadline = clock.monotonic() + REBOOT_APP_TIMEOUT
+        if not wait_until(lambda: shell_succeeds(device_ip, "pidof com.sy1vi3.cosmog"), app_deadline):
+            logging.error(f"Cosmog app is not running on device {device_id} after reboot.")
+            return False
+        if is_registered is not None and not wait_until(is_registered, app_deadline):
+            logging.warning(f"Device {device_id} is not alive in Rotom yet, relying on the grace period.")
+        logging.info(f"Started Cosmog app on device {device_id}, ready {clock.monotonic() - start:.0f}s after reboot.")
+        return True
 
-    except subprocess.CalledProcessError as e:
+    except (AdbError, subprocess.SubprocessError, OSError) as e:
+        if not is_reachable(device_ip):
+            raise DeviceUnreachable(f"nothing answers on {device_ip} ({e})") from e
         logging.error(f"Failed to reboot and start device {device_id}: {e}")
+        return False
 
-def check_devices():
-    try:
-        response = requests.get(STATUS_URL, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        parent_devices = {device['deviceId']: device for device in data.get('devices', [])}
-        worker_devices = {worker['workerId']: worker for worker in data.get('workers', [])}
-        return parent_devices, worker_devices
-    except requests.RequestException as e:
-        logging.error(f"Failed to fetch device status: {e}")
-        return {}, {}
-
-def get_status_summary(parent_devices, worker_devices):
-    # Calculate total_workers and set thresholds dynamically
-    total_workers = len(worker_devices)
-    UNALLOCATED_WORKER_THRESHOLD = round(0.09 * total_workers)
-    MIN_WORKER_THRESHOLD = total_workers - UNALLOCATED_WORKER_THRESHOLD
-
-    offline_parents = [device_id for device_id, device in parent_devices.items() if not device.get('isAlive', False)]
-    unallocated_workers = [worker_id for worker_id, worker in worker_devices.items() if
-                           not worker.get('isAllocated', False)]
-
-    total_parents = len(parent_devices)
+RemediationResult = namedtuple('RemediationResult', ['device_id', 'kind', 'ok', 'finished_at', 'duration', 'error'])
+
+class RemediationExecutor:
+    """Runs remediation jobs (app restarts, reboots) off the monitor loop.
+
+    At most REMEDIATION_WORKERS jobs run at once across the fleet. Jobs for the same
+    device are queued and run one after another, and a job is dropped if the same kind
+    of job is already queued or running for that device. Every finished job is passed
+    to on_complete as a RemediationResult, from the worker thread that ran it.
+
+    Several executors can share one thread pool, so monitored sites draw from a
+    common REMEDIATION_WORKERS budget while keeping their own queues and results.
+    """
+
+    def __init__(self, max_workers, on_complete=None, pool=None):
+        self._owns_pool = pool is None
+        self._pool = pool or ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="remediation")
+        self._lock = threading.Lock()
+        self._device_jobs = {}  # device_id -> deque of (kind, func, args)
+        self._pending = set()  # (device_id, kind) queued or running
+        self.on_complete = on_complete
+
+    def submit(self, device_id, kind, func, *args):
+        with self._lock:
+            if (device_id, kind) in self._pending:
+                logging.debug(f"Dropping duplicate {kind} job for device {device_id}")
+                return False
+            self._pending.add((device_id, kind))
+            jobs = self._device_jobs.setdefault(device_id, deque())
+            # Run in the submitter's context so job logs keep their site prefix
+            jobs.append((kind, functools.partial(contextvars.copy_context().run, func), args))
+            if len(jobs) == 1:
+                # No job running for this device, start draining its queue
+                self._pool.submit(self._run_device_jobs, device_id)
+        logging.info(f"Queued {kind} job for device {device_id}")
+        return True
+
+    def is_busy(self, device_id):
+        with self._lock:
+            return device_id in self._device_jobs
+
+    def shutdown(self, wait=True):
+        if self._owns_pool:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+
+    def _run_device_jobs(self, device_id):
+        while True:
+            with self._lock:
+                if shutting_down.is_set():
+                    jobs = self._device_jobs.pop(device_id)
+                    self._pending.difference_update((device_id, kind) for kind, _, _ in jobs)
+                    logging.info(f"Dropped {len(jobs)} remediation jobs for device {device_id}, agent is stopping.")
+                    return
+                kind, func, args = self._device_jobs[device_id][0]
+
+            start = clock.monotonic()
+            error = None
+            try:
+                ok = bool(func(*args))
+            except RemediationCancelled:
+                logging.warning(f"{kind} job for device {device_id} cancelled, agent is stopping.")
+                continue  # Dropped with the rest of the device's jobs above
+            except Exception as e:
+                logging.error(f"{kind} job for device {device_id} raised: {e}")
+                ok = False
+                error = e
+            if self.on_complete:
+                self.on_complete(RemediationResult(device_id, kind, ok, clock.now(), clock.monotonic() - start, error))
+
+            with self._lock:
+                jobs = self._device_jobs[device_id]
+                jobs.popleft()
+                self._pending.discard((device_id, kind))
+                if not jobs:
+                    del self._device_jobs[device_id]
+                    return
+
+HEALTHY, SUSPECT, APP_RESTART, REBOOT, QUARANTINED = "healthy", "suspect", "app-restart", "reboot", "quarantined"
+ESCALATION_STATES = (HEALTHY, SUSPECT, APP_RESTART, REBOOT, QUARANTINED)
+
+BREAKER_CLOSED, BREAKER_OPEN, BREAKER_HALF_OPEN = "closed", "open", "half-open"
+
+class CircuitBreaker:
+    """Fleet-wide remediation halt.
+
+    Trips when too many parents are offline at once, more than
+    CIRCUIT_BREAKER_MAX_OFFLINE and more than CIRCUIT_BREAKER_MAX_OFFLINE_RATIO of the
+    fleet, which points at an upstream problem (Rotom, the network, the adb server)
+    that restarting devices won't fix, or when CIRCUIT_BREAKER_MAX_FAILURES
+    remediation jobs fail within CIRCUIT_BREAKER_COOLDOWN seconds.
+
+    After CIRCUIT_BREAKER_COOLDOWN seconds it closes if the fleet is back to normal,
+    and otherwise goes half-open: up to CIRCUIT_BREAKER_PROBES devices may be
+    remediated. If one of them recovers the repairs work, so the breaker closes and
+    doesn't trip on the offline count again until it has dropped below the limit.
+    If a probe job fails, or none of the probed devices recovers within the cooldown,
+    the breaker opens again.
+    """
+
+    def __init__(self, max_offline=CIRCUIT_BREAKER_MAX_OFFLINE, max_offline_ratio=CIRCUIT_BREAKER_MAX_OFFLINE_RATIO,
+                 max_failures=CIRCUIT_BREAKER_MAX_FAILURES, cooldown=CIRCUIT_BREAKER_COOLDOWN,
+                 probes=CIRCUIT_BREAKER_PROBES):
+        self.max_offline = max_offline
+        self.max_offline_ratio = max_offline_ratio
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.probes = max(1, probes)
+        self.state = BREAKER_CLOSED
+        self.failures = deque()  # clock.time() of recently failed jobs
+        self.open_until = 0.0  # End of the cooldown while open, of the probe window while half-open
+        self.reason = None  # Set while not closed
+        self.probing = set()  # Devices remediated while half-open
+        self.offline_armed = True  # Cleared when probes worked although many parents are offline
+        self.trips = 0
+
+    def is_open(self):
+        """True while remediation is halted or limited to probes."""
+        return self.state != BREAKER_CLOSED
+
+    def too_many_offline(self, offline, total):
+        if offline <= self.max_offline:
+            return False
+        return self.max_offline_ratio <= 0 or offline > self.max_offline_ratio * total
+
+    def trip(self, reason, now):
+        """Open (or hold open) the breaker, returns True if it was not open before."""
+        opened = self.state != BREAKER_OPEN
+        if opened:
+            self.trips += 1
+            logging.warning(f"Circuit breaker open for {self.cooldown}s, remediation halted: {reason}")
+        self.state = BREAKER_OPEN
+        self.open_until = now + self.cooldown
+        self.reason = reason
+        self.probing.clear()
+        return opened
+
+    def close(self, message):
+        logging.info(f"Circuit breaker closed, remediation resumed: {message}")
+        self.state = BREAKER_CLOSED
+        self.reason = None
+        self.probing.clear()
+
+    def update(self, offline, total, now):
+        """Advance the breaker by one status check, returns True if it opened."""
+        too_many = self.too_many_offline(offline, total)
+        if not too_many:
+            self.offline_armed = True
+        if self.state == BREAKER_CLOSED:
+            if too_many and self.offline_armed:
+                return self.trip(f"{offline}/{total} parent devices offline", now)
+        elif self.state == BREAKER_OPEN and now >= self.open_until:
+            if too_many:
+                self.state = BREAKER_HALF_OPEN
+                self.open_until = now + self.cooldown
+                logging.info(f"Circuit breaker half-open, trying remediation on up to {self.probes} devices.")
+            else:
+                self.close("fleet is back to normal")
+        elif self.state == BREAKER_HALF_OPEN:
+            if not too_many:
+                self.close("fleet is back to normal")
+            elif now >= self.open_until:
+                return self.trip(f"no device recovered after remediating {len(self.probing)} devices", now)
+        return False
+
+    def allow(self, device_id):
+        """Whether a remediation job may be started for the device."""
+        if self.state == BREAKER_CLOSED:
+            return True
+        if self.state == BREAKER_HALF_OPEN and (device_id in self.probing or len(self.probing) < self.probes):
+            self.probing.add(device_id)
+            return True
+        return False
+
+    def record_recovery(self, device_id):
+        if self.state == BREAKER_HALF_OPEN and device_id in self.probing:
+            self.offline_armed = False
+            self.close(f"device {device_id} recovered after remediation")
+
+    def record_result(self, ok, now, device_id=None):
+        """Count a finished job, returns True if it opened the breaker."""
+        if self.state == BREAKER_HALF_OPEN and device_id in self.probing and not ok:
+            return self.trip(f"remediation of device {device_id} failed while probing", now)
+        if ok:
+            return False
+        self.failures.append(now)
+        while self.failures[0] < now - self.cooldown:
+            self.failures.popleft()
+        if 0 < self.max_failures <= len(self.failures):
+            self.failures.clear()
+            return self.trip(f"{self.max_failures} remediation jobs failed within {self.cooldown}s", now)
+        return False
+
+class DeviceEscalation:
+    __slots__ = ('state', 'strikes', 'restarts', 'reboots', 'next_action_at')
+
+    def __init__(self, state=SUSPECT, strikes=0, restarts=0, reboots=0, next_action_at=0.0):
+        self.state = state
+        self.strikes = strikes  # Consecutive unhealthy checks while suspect
+        self.restarts = restarts
+        self.reboots = reboots
+        self.next_action_at = next_action_at  # clock.time() the next escalation step is allowed
+
+class EscalationPolicy:
+    """Per-device remediation state machine: healthy -> suspect -> app-restart -> reboot -> quarantined.
+
+    A device that is offline, alive with too few workers ("bugged") or running clearly
+    fewer workers than usual ("degraded", see WorkerAnomalyDetector) becomes suspect.
+    After OFFLINE_THRESHOLD or BUGGED_DEVICE_THRESHOLD consecutive unhealthy checks it
+    gets an app restart. If it still hasn't recovered once its backoff is over, it gets
+    more app restarts up to MAX_APP_RESTARTS, then reboots up to MAX_REBOOTS, and is
+    finally quarantined for QUARANTINE_TIME seconds before starting over. The backoff
+    starts at ESCALATION_BACKOFF seconds and doubles with every attempt. A healthy
+    check resets the device. Nothing is started while the circuit breaker is open, and
+    only a few probes while it is half-open.
+    """
+
+    def __init__(self, offline_threshold=OFFLINE_THRESHOLD, bugged_threshold=BUGGED_DEVICE_THRESHOLD,
+                 max_restarts=MAX_APP_RESTARTS, max_reboots=MAX_REBOOTS, backoff=ESCALATION_BACKOFF,
+                 backoff_max=ESCALATION_BACKOFF_MAX, quarantine_time=QUARANTINE_TIME, breaker=None):
+        self.offline_threshold = offline_threshold
+        self.bugged_threshold = bugged_threshold
+        self.max_restarts = max_restarts
+        self.max_reboots = max_reboots
+        self.backoff_base = backoff
+        self.backoff_max = backoff_max
+        self.quarantine_time = quarantine_time
+        self.devices = {}  # device_id -> DeviceEscalation, healthy devices aren't tracked
+        self.breaker = breaker or CircuitBreaker()
+
+    def state_of(self, device_id):
+        escalation = self.devices.get(device_id)
+        return escalation.state if escalation else HEALTHY
+
+    def backoff(self, escalation):
+        attempts = escalation.restarts + escalation.reboots
+        return min(self.backoff_base * 2 ** max(attempts - 1, 0), self.backoff_max)
+
+    def next_action(self, escalation):
+        if escalation.state in (SUSPECT, APP_RESTART) and escalation.restarts < self.max_restarts:
+            return "restart"
+        if escalation.reboots < self.max_reboots:
+            return "reboot"
+        return None
+
+    def start(self, device_id, kind, now):
+        """Record a remediation job submitted for the device."""
+        escalation = self.devices.setdefault(device_id, DeviceEscalation())
+        if kind == "reboot":
+            escalation.reboots += 1
+            escalation.state = REBOOT
+        else:
+            escalation.restarts += 1
+            escalation.state = APP_RESTART
+        escalation.strikes = 0
+        escalation.next_action_at = now + self.backoff(escalation)
+        logging.info(f"Escalating device {device_id} to {escalation.state} "
+                     f"(restarts {escalation.restarts}/{self.max_restarts}, reboots {escalation.reboots}/{self.max_reboots})")
+
+    def record_result(self, result, now):
+        """Start the backoff from the end of the job, returns True if the result opened the breaker.
+
+        Jobs that couldn't reach the device don't count as failed repairs, the device
+        is rediscovered at its new address first.
+        """
+        escalation = self.devices.get(result.device_id)
+        if escalation is not None and escalation.state in (APP_RESTART, REBOOT):
+            escalation.next_action_at = result.finished_at.timestamp() + self.backoff(escalation)
+        if isinstance(result.error, DeviceUnreachable):
+            return False
+        return self.breaker.record_result(result.ok, now, result.device_id)
+
+    def evaluate(self, unhealthy, is_excluded, now):
+        """Advance the state machines by one status check.
+
+        unhealthy maps device_id to "offline", "bugged" or "degraded". Devices for which
+        is_excluded returns True (grace period, job in progress) are left as they are.
+        Returns the (device_id, kind) remediation jobs to run and the newly quarantined
+        devices. The caller records every job it actually submits with start(), a job
+        that doesn't run is asked for again at the next check.
+        """
+        actions = []
+        quarantined = []
+        for device_id in sorted(unhealthy.keys() | self.devices.keys()):  # Stable remediation order
+            if device_id not in unhealthy:
+                self.breaker.record_recovery(device_id)  # Also during the grace period
+            if is_excluded(device_id):
+                continue
+            escalation = self.devices.get(device_id)
+            reason = unhealthy.get(device_id)
+            if reason is None:
+                logging.info(f"Device {device_id} recovered ({escalation.state} -> {HEALTHY})")
+                del self.devices[device_id]
+                continue
+            if escalation is None:
+                escalation = self.devices[device_id] = DeviceEscalation()
+                logging.info(f"Device {device_id} is {SUSPECT} ({reason})")
+
+            if escalation.state == SUSPECT:
+                escalation.strikes += 1
+                logging.debug(f"Device {device_id} {reason} count: {escalation.strikes}")
+                threshold = self.offline_threshold if reason == "offline" else self.bugged_threshold
+                if escalation.strikes < threshold:
+                    continue
+            elif now < escalation.next_action_at:
+                continue
+            elif escalation.state == QUARANTINED:
+                logging.info(f"Quarantine ended for device {device_id}")
+                self.devices[device_id] = DeviceEscalation(strikes=1)
+                continue
+
+            kind = self.next_action(escalation)
+            if kind is None:
+                escalation.state = QUARANTINED
+                escalation.next_action_at = now + self.quarantine_time
+                logging.error(f"Device {device_id} quarantined for {self.quarantine_time}s, "
+                              f"{escalation.restarts} app restarts and {escalation.reboots} reboots did not fix it")
+                quarantined.append(device_id)
+            elif not self.breaker.allow(device_id):
+                logging.debug(f"Circuit breaker {self.breaker.state}, not starting {kind} for device {device_id}")
+            else:
+                actions.append((device_id, kind))
+        return actions, quarantined
+
+    def state_counts(self):
+        counts = dict.fromkeys(ESCALATION_STATES[1:], 0)
+        for escalation in list(self.devices.values()):  # Also read from the metrics thread
+            counts[escalation.state] += 1
+        return counts
+
+    def to_dict(self):
+        return {device_id: [e.state, e.strikes, e.restarts, e.reboots, e.next_action_at]
+                for device_id, e in self.devices.items()}
+
+    def load(self, state):
+        self.devices = {device_id: DeviceEscalation(*values) for device_id, values in state.items()}
+
+class ParentStatus:
+    __slots__ = ('device_id', 'is_alive')
+
+    def __init__(self, device_id, is_alive):
+        self.device_id = device_id
+        self.is_alive = is_alive
+
+class WorkerStatus:
+    __slots__ = ('worker_id', 'is_allocated', 'parent_device_id')
+
+    def __init__(self, worker_id, is_allocated, parent_device_id):
+        self.worker_id = worker_id
+        self.is_allocated = is_allocated
+        self.parent_device_id = parent_device_id
+
+def parent_status(device):
+    return ParentStatus(device['deviceId'], bool(device.get('isAlive', False)))
+
+def worker_status(worker):
+    return WorkerStatus(worker['workerId'], bool(worker.get('isAllocated', False)), worker.get('parentDeviceId'))
+
+# Top level keys of the /api/status payload that are kept, and how their items are reduced
+STATUS_RECORD_BUILDERS = {'devices': parent_status, 'workers': worker_status}
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_VALUE_TERMINATORS = ' \t\n\r,]}'
+_NUMBER_START = '-0123456789'
+_json_decoder = json.JSONDecoder()
+
+def iter_status_records(chunks):
+    """Incrementally parse a /api/status body given as an iterable of byte chunks.
+
+    Yields ('devices', ParentStatus) and ('workers', WorkerStatus) pairs as soon as each
+    array item has been received. Every other top level value is decoded and dropped
+    straight away, so the full payload is never held in memory.
+    """
+    chunks = iter(chunks)
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buf = ''
+    pos = 0
+    eof = False
+
+    def fill(size=0):
+        """Read at least one more chunk, and more until size characters are buffered."""
+        nonlocal buf, pos, eof
+        parts = [buf[pos:]]
+        buffered = len(parts[0])
+        while True:
+            chunk = next(chunks, None)
+            if chunk is None:
+                eof = True
+                parts.append(utf8.decode(b'', final=True))
+                break
+            parts.append(utf8.decode(chunk))
+            buffered += len(parts[-1])
+            if buffered >= size:
+                break
+        buf = ''.join(parts)
+        pos = 0
+
+    def peek():
+        nonlocal pos
+        while True:
+            pos = _WHITESPACE.match(buf, pos).end()
+            if pos < len(buf):
+                return buf[pos]
+            if eof:
+                raise ValueError("Unexpected end of status payload")
+            fill()
+
+    def take(expected):
+        nonlocal pos
+        char = peek()
+        if char not in expected:
+            raise ValueError(f"Unexpected {char!r} in status payload")
+        pos += 1
+        return char
+
+    def value():
+        nonlocal pos
+        peek()
+        while True:
+            try:
+                obj, end = _json_decoder.raw_decode(buf, pos)
+                # Strings, objects, arrays and literals end themselves, but a number cut off
+                # by the chunk boundary still decodes, so only trust a number once the
+                # character that ends it has been received
+                if eof or buf[pos] not in _NUMBER_START or (end < len(buf) and buf[end] in _VALUE_TERMINATORS):
+                    pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            # Double the buffer, so a value spanning many chunks is decoded a few times
+            # instead of once per chunk
+            fill(2 * (len(buf) - pos))
+
+    take('{')
+    if peek() == '}':
+        return
+    while True:
+        key = value()
+        take(':')
+        builder = STATUS_RECORD_BUILDERS.get(key)
+        if builder and peek() == '[':
+            take('[')
+            if peek() == ']':
+                take(']')
+            else:
+                while True:
+                    yield key, builder(value())
+                    if take(',]') == ']':
+                        break
+        else:
+            value()
+        if take(',}') == '}':
+            return
+
+if STATUS_JSON_BACKEND == 'orjson' and orjson is None:
+    logging.warning("STATUS_JSON_BACKEND is orjson but orjson is not installed, using stream.")
+
+def parse_status(response):
+    parent_devices = {}
+    worker_devices = {}
+    if orjson is not None and STATUS_JSON_BACKEND == 'orjson':
+        # Faster per poll, but buffers the whole body and decodes every field
+        data = orjson.loads(response.content)
+        for device in data.get('devices', []):
+            record = parent_status(device)
+            parent_devices[record.device_id] = record
+        for worker in data.get('workers', []):
+            record = worker_status(worker)
+            worker_devices[record.worker_id] = record
+    else:
+        for key, record in iter_status_records(response.iter_content(chunk_size=65536)):
+            if key == 'devices':
+                parent_devices[record.device_id] = record
+            else:
+                worker_devices[record.worker_id] = record
+    return parent_devices, worker_devices
+
+def create_status_session(hosts=1):
+    """Keep-alive session for status requests, shared by the clients of all sites."""
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=hosts, pool_maxsize=4))
+    session.mount("https://", HTTPAdapter(pool_connections=hosts, pool_maxsize=4))
+    return session
+
+class StatusClient:
+    """Fetches STATUS_URL over a persistent keep-alive session.
+
+    Failed requests are retried with jittered exponential backoff, honouring
+    Retry-After when the server sends one, for at most max_time seconds in total
+    when fetch() is given one. The ETag and Last-Modified of the last
+    response are sent back as conditional headers, and a 304 reuses the last parsed
+    snapshot without downloading or parsing the payload again.
+    """
+
+    def __init__(self, url=STATUS_URL, timeout=TIMEOUT, retries=STATUS_RETRIES,
+                 backoff=STATUS_BACKOFF, backoff_max=STATUS_BACKOFF_MAX, session=None):
+        self.url = url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.session = session or create_status_session()
+        self._validators = {}
+        self._snapshot = None
+
+    def _retry_delay(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(self.backoff_max, int(retry_after))
+        # Full jitter, spreads retries out when several agents hit the same Rotom
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
+    def _get(self, max_time=None):
+        deadline = time.monotonic() + max_time if max_time else math.inf
+        for attempt in range(self.retries + 1):
+            response = None
+            try:
+                timeout = min(self.timeout, max(1.0, deadline - time.monotonic()))
+                response = self.session.get(self.url, timeout=timeout, stream=True, headers=self._validators)
+                if response.status_code < 500 and response.status_code != 429:
+                    return response
+                response.close()
+                response.raise_for_status()
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                delay = self._retry_delay(attempt, response)
+                if attempt == self.retries or time.monotonic() + delay >= deadline:
+                    raise
+                logging.warning(f"Fetching device status failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    @timed("check_devices")
+    def fetch(self, max_time=None):
+        """Return (parent_devices, worker_devices, changed), or None if the status couldn't be fetched."""
+        try:
+            with self._get(max_time) as response:
+                if response.status_code == 304 and self._snapshot is not None:
+                    return self._snapshot + (False,)
+                response.raise_for_status()
+                snapshot = parse_status(response)
+                self._validators = {}
+                if response.headers.get("ETag"):
+                    self._validators["If-None-Match"] = response.headers["ETag"]
+                if response.headers.get("Last-Modified"):
+                    self._validators["If-Modified-Since"] = response.headers["Last-Modified"]
+                self._snapshot = snapshot
+                return snapshot + (True,)
+        except requests.RequestException as e:
+            logging.error(f"Failed to fetch device status: {e}")
+        except (ValueError, KeyError, TypeError) as e:
+            logging.error(f"Failed to parse device status: {e}")
+        self._validators = {}
+        self._snapshot = None
+        return None
+
+status_client = StatusClient()
+
+class PollScheduler:
+    """Picks the delay until the next status poll.
+
+    Polls every MIN_POLL_INTERVAL while the fleet is changing and backs off by
+    POLL_BACKOFF_FACTOR per quiet poll up to MAX_POLL_INTERVAL. While a problem is
+    being tracked the delay never goes above PROBLEM_CHECK_INTERVAL.
+    """
+
+    def __init__(self, min_interval=MIN_POLL_INTERVAL, max_interval=MAX_POLL_INTERVAL,
+                 problem_interval=PROBLEM_CHECK_INTERVAL, backoff_factor=POLL_BACKOFF_FACTOR):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.problem_interval = problem_interval
+        self.backoff_factor = backoff_factor
+        self.interval = min_interval
+
+    def update(self, changes, in_problem_mode):
+        if changes:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff_factor)
+        if in_problem_mode:
+            self.interval = min(self.interval, self.problem_interval)
+        return self.interval
+
+FleetEvent = namedtuple('FleetEvent', ['kind', 'device_id', 'parent_id'])
+
+class FleetState:
+    """Fleet model that is updated from /api/status snapshots as a diff.
+
+    Keeps the allocated workers of every parent, the offline parents, the unallocated
+    workers and the alive parents with at most one worker up to date as devices
+    change, and returns a FleetEvent for every change, so evaluating a poll only costs
+    as much as what changed since the last one.
+    """
+
+    def __init__(self):
+        self.parents = {}  # device_id -> isAlive
+        self.workers = {}  # worker_id -> (isAllocated, parentDeviceId)
+        self.parent_workers = {}  # device_id -> set of allocated worker_ids
+        self.offline_parents = set()
+        self.unallocated_workers = set()
+        self.low_worker_parents = set()  # Alive parents with 0-1 allocated workers
+
+    @property
+    def total_parents(self):
+        return len(self.parents)
+
+    @property
+    def total_workers(self):
+        return len(self.workers)
+
+    def thresholds(self, expected_workers=None):
+        """Return (UNALLOCATED_WORKER_THRESHOLD, MIN_WORKER_THRESHOLD).
+
+        The unallocated threshold is 9% of the current worker count, the minimum is 9%
+        below the usual worker count (expected_workers, learned from history) and 0
+        while there isn't enough history to know what is usual.
+        """
+        unallocated_worker_threshold = round(0.09 * self.total_workers)
+        if not expected_workers:
+            return unallocated_worker_threshold, 0
+        return unallocated_worker_threshold, expected_workers - round(0.09 * expected_workers)
+
+    def apply(self, parent_devices, worker_devices):
+        events = []
+        touched_parents = set()
+
+        for device_id, device in parent_devices.items():
+            alive = device.is_alive
+            old_alive = self.parents.get(device_id)
+            if old_alive == alive:
+                continue
+            if old_alive is None:
+                events.append(FleetEvent("parent_added", device_id, None))
+            self.parents[device_id] = alive
+            if alive:
+                self.offline_parents.discard(device_id)
+                if old_alive is not None:
+                    events.append(FleetEvent("parent_online", device_id, None))
+            else:
+                self.offline_parents.add(device_id)
+                events.append(FleetEvent("parent_offline", device_id, None))
+            touched_parents.add(device_id)
+
+        for device_id in self.parents.keys() - parent_devices.keys():
+            del self.parents[device_id]
+            self.offline_parents.discard(device_id)
+            self.low_worker_parents.discard(device_id)
+            events.append(FleetEvent("parent_removed", device_id, None))
+
+        for worker_id, worker in worker_devices.items():
+            allocated = worker.is_allocated
+            new_state = (allocated, worker.parent_device_id if allocated else None)
+            old_state = self.workers.get(worker_id)
+            if old_state == new_state:
+                continue
+            self.workers[worker_id] = new_state
+            if old_state is None:
+                events.append(FleetEvent("worker_added", worker_id, new_state[1]))
+            else:
+                self._unlink_worker(worker_id, old_state, touched_parents)
+            self._link_worker(worker_id, new_state, touched_parents)
+
+            if old_state is not None and old_state[0] != allocated:
+                kind = "worker_allocated" if allocated else "worker_unallocated"
+                events.append(FleetEvent(kind, worker_id, new_state[1] or old_state[1]))
+            elif old_state is not None and allocated:
+                events.append(FleetEvent("worker_moved", worker_id, new_state[1]))
+
+        for worker_id in self.workers.keys() - worker_devices.keys():
+            old_state = self.workers.pop(worker_id)
+            self._unlink_worker(worker_id, old_state, touched_parents)
+            events.append(FleetEvent("worker_removed", worker_id, old_state[1]))
+
+        for device_id in touched_parents:
+            self._update_low_worker(device_id)
+        return events
+
+    def _link_worker(self, worker_id, state, touched_parents):
+        allocated, parent_id = state
+        if not allocated:
+            self.unallocated_workers.add(worker_id)
+        elif parent_id:
+            self.parent_workers.setdefault(parent_id, set()).add(worker_id)
+            touched_parents.add(parent_id)
+
+    def _unlink_worker(self, worker_id, state, touched_parents):
+        allocated, parent_id = state
+        if not allocated:
+            self.unallocated_workers.discard(worker_id)
+        elif parent_id:
+            workers = self.parent_workers.get(parent_id)
+            if workers is not None:
+                workers.discard(worker_id)
+                if not workers:
+                    del self.parent_workers[parent_id]
+            touched_parents.add(parent_id)
+
+    def _update_low_worker(self, device_id):
+        if self.parents.get(device_id) and len(self.parent_workers.get(device_id, ())) <= 1:
+            self.low_worker_parents.add(device_id)
+        else:
+            self.low_worker_parents.discard(device_id)
+
+class WorkerAnomalyDetector:
+    """Flags parents that run clearly fewer workers than they usually do.
+
+    Keeps the allocated worker count of every parent over the last ANOMALY_WINDOW
+    polls in a ring of flat arrays (one slot per parent) with running sums, so the
+    per-parent mean, standard deviation and z-score of the current count are computed
+    for the whole fleet in one pass: with numpy when it is installed, in a plain loop
+    over the arrays otherwise. A parent is degraded when it has at least
+    ANOMALY_MIN_SAMPLES samples, its z-score is at or below -ANOMALY_Z_THRESHOLD and it
+    runs at least ANOMALY_MIN_DROP fewer workers than its mean, e.g. 3 of its usual 6.
+    Samples of offline or degraded parents are left out of the window, so a parent
+    doesn't get used to its own problem until it has been degraded for a whole window.
+
+    It also keeps the total worker count of the last ANOMALY_WINDOW polls (seeded from
+    the fleet history) and uses its median as the expected worker count. Totals below
+    the minimum worker threshold are held back the same way, until they have lasted a
+    whole window and replace it, e.g. after devices were retired.
+    """
+
+    def __init__(self, window=ANOMALY_WINDOW, min_samples=ANOMALY_MIN_SAMPLES, z_threshold=ANOMALY_Z_THRESHOLD,
+                 min_drop=ANOMALY_MIN_DROP, min_std=ANOMALY_MIN_STD, backend=ANOMALY_BACKEND):
+        self.window = max(2, window)
+        self.min_samples = max(1, min(min_samples, self.window))
+        self.z_threshold = z_threshold
+        self.min_drop = min_drop
+        self.min_std = min_std
+        if backend == 'numpy' and numpy is None:
+            logging.warning("ANOMALY_BACKEND is numpy but numpy is not installed, using arrays.")
+        self.use_numpy = numpy is not None and backend in ('auto', 'numpy')
+        self.slots = {}  # device_id -> slot in the arrays below
+        self.device_ids = []  # slot -> device_id, None for free slots
+        self.free_slots = []
+        self.current = array('d')  # Allocated workers at the last poll
+        self.alive = array('d')  # 1.0 if alive at the last poll
+        self.sums = array('d')  # Sum, sum of squares and number of samples in the window
+        self.squares = array('d')
+        self.counts = array('d')
+        self.values = [array('d') for _ in range(self.window)]  # Ring of past polls
+        self.masks = [array('d') for _ in range(self.window)]  # 1.0 where the sample is part of the window
+        self.position = 0
+        self.degraded = {}  # device_id -> (allocated workers, usual allocated workers)
+        self.worker_totals = deque(maxlen=self.window)
+        self.low_worker_totals = []  # Consecutive totals below the minimum worker threshold
+
+    def seed(self, worker_totals):
+        """Seed the expected worker count with the total worker counts of earlier polls."""
+        self.worker_totals.extend(worker_totals)
+
+    @property
+    def expected_workers(self):
+        if len(self.worker_totals) < self.min_samples:
+            return None
+        return round(statistics.median(self.worker_totals))
+
+    def _columns(self):
+        return (self.current, self.alive, self.sums, self.squares, self.counts, *self.values, *self.masks)
+
+    def _sync(self, fleet):
+        for device_id in self.slots.keys() - fleet.parents.keys():
+            slot = self.slots.pop(device_id)
+            for column in self._columns():
+                column[slot] = 0.0
+            self.device_ids[slot] = None
+            self.free_slots.append(slot)
+
+        new_devices = [device_id for device_id in fleet.parents if device_id not in self.slots]
+        grow = len(new_devices) - len(self.free_slots)
+        if grow > 0:
+            self.free_slots.extend(range(len(self.device_ids) + grow - 1, len(self.device_ids) - 1, -1))
+            self.device_ids.extend([None] * grow)
+            zeros = array('d', bytes(8 * grow))
+            for column in self._columns():
+                column.extend(zeros)
+        for device_id in new_devices:
+            slot = self.free_slots.pop()
+            self.slots[device_id] = slot
+            self.device_ids[slot] = device_id
+
+        current, alive, slots = self.current, self.alive, self.slots
+        parent_workers = fleet.parent_workers
+        for device_id, is_alive in fleet.parents.items():
+            slot = slots[device_id]
+            current[slot] = len(parent_workers.get(device_id, ()))
+            alive[slot] = 1.0 if is_alive else 0.0
+
+    def _score_numpy(self):
+        current, alive, sums, squares, counts = (numpy.frombuffer(column) for column in (
+            self.current, self.alive, self.sums, self.squares, self.counts))
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            mean = sums / counts
+            std = numpy.sqrt(numpy.maximum(squares / counts - mean * mean, 0.0))
+            z = (current - mean) / numpy.maximum(std, self.min_std)
+            flagged = ((alive > 0) & (counts >= self.min_samples) & (z <= -self.z_threshold)
+                       & (current <= mean * (1 - self.min_drop)))
+        sample = array('d')
+        sample.frombytes(((alive > 0) & ~flagged).astype(numpy.float64).tobytes())
+        return {int(slot): float(mean[slot]) for slot in numpy.flatnonzero(flagged)}, sample
+
+    def _score_arrays(self):
+        flagged = {}
+        sample = array('d', self.alive)
+        for slot, (value, alive, total, squares, count) in enumerate(
+                zip(self.current, self.alive, self.sums, self.squares, self.counts)):
+            if not alive or count < self.min_samples:
+                continue
+            mean = total / count
+            std = max(math.sqrt(max(squares / count - mean * mean, 0.0)), self.min_std)
+            if (value - mean) / std <= -self.z_threshold and value <= mean * (1 - self.min_drop):
+                flagged[slot] = mean
+                sample[slot] = 0.0
+        return flagged, sample
+
+    def _push(self, sample):
+        """Add the current counts to the window where sample is 1.0 and drop the oldest poll."""
+        old_values, old_mask = self.values[self.position], self.masks[self.position]
+        if self.use_numpy:
+            current, new_mask, values, mask, sums, squares, counts = (numpy.frombuffer(column) for column in (
+                self.current, sample, old_values, old_mask, self.sums, self.squares, self.counts))
+            sums += current * new_mask - values * mask
+            squares += current * current * new_mask - values * values * mask
+            counts += new_mask - mask
+        else:
+            sums, squares, counts = self.sums, self.squares, self.counts
+            for slot, (value, weight, old_value, old_weight) in enumerate(zip(self.current, sample, old_values, old_mask)):
+                sums[slot] += value * weight - old_value * old_weight
+                squares[slot] += value * value * weight - old_value * old_value * old_weight
+                counts[slot] += weight - old_weight
+        self.values[self.position] = array('d', self.current)
+        self.masks[self.position] = sample
+        self.position = (self.position + 1) % self.window
+
+    def update(self, fleet, changed=True):
+        """Score the fleet after a poll and add it to the window, returns the degraded parents."""
+        if changed:
+            self._sync(fleet)
+        flagged, sample = self._score_numpy() if self.use_numpy else self._score_arrays()
+        self._push(sample)
+
+        degraded = {self.device_ids[slot]: (int(self.current[slot]), mean) for slot, mean in flagged.items()}
+        for device_id in degraded.keys() - self.degraded.keys():
+            workers, usual = degraded[device_id]
+            logging.warning(f"Device {device_id} is running {workers} workers, usually {usual:.1f}")
+        for device_id in self.degraded.keys() - degraded.keys():
+            logging.info(f"Device {device_id} worker count is back to normal")
+        self.degraded = degraded
+
+        # A fleet-wide drop shouldn't become the new normal either, unless it lasts a whole window
+        expected = self.expected_workers
+        if expected is None or fleet.total_workers >= fleet.thresholds(expected)[1]:
+            self.worker_totals.append(fleet.total_workers)
+            self.low_worker_totals.clear()
+        else:
+            self.low_worker_totals.append(fleet.total_workers)
+            if len(self.low_worker_totals) >= self.window:
+                self.worker_totals.extend(self.low_worker_totals)
+                self.low_worker_totals.clear()
+                logging.info(f"Worker count has been low for {self.window} polls, expecting {self.expected_workers} workers now")
+        return degraded
+
+def get_status_summary(fleet, breaker, detector=None):
+    total_workers = fleet.total_workers
+    expected_workers = detector.expected_workers if detector else None
+    UNALLOCATED_WORKER_THRESHOLD, MIN_WORKER_THRESHOLD = fleet.thresholds(expected_workers)
+    offline_parents = fleet.offline_parents
+    unallocated_workers = fleet.unallocated_workers
+    total_parents = fleet.total_parents
 
     if total_workers == 0:
         return "Critical Problem", f"0 worker devices detected. This is a critical issue."
     elif total_workers < MIN_WORKER_THRESHOLD:
-        return "Potential Problem", f"{total_workers} worker devices detected. Below the lenient threshold of {MIN_WORKER_THRESHOLD} workers."
-    elif len(offline_parents) > 10:
+        return "Potential Problem", (f"{total_workers} worker devices detected (usually {expected_workers}). "
+                                     f"Below the lenient threshold of {MIN_WORKER_THRESHOLD} workers.")
+    elif breaker.is_open() and breaker.too_many_offline(len(offline_parents), total_parents):
         return "Major Issue", f"{len(offline_parents)}/{total_parents} parent devices offline. Monitoring and restarting halted."
     elif offline_parents:
         return "Problem", f"{len(offline_parents)}/{total_parents} parent devices offline."
     elif len(unallocated_workers) > UNALLOCATED_WORKER_THRESHOLD:
         percent_unallocated = (len(unallocated_workers) / total_workers) * 100
         return "Minor Issue", f"{len(unallocated_workers)} ({percent_unallocated:.2f}%) worker devices unallocated."
+    elif detector and detector.degraded:
+        return "Minor Issue", f"{len(detector.degraded)}/{total_parents} parent devices running fewer workers than usual."
     else:
         return "Everything Good", f"All parent devices are online. {len(unallocated_workers)} unallocated workers (within acceptable range)."
 
-def fix_offline_devices_on_startup(grace_period_devices):
+def fix_offline_devices_on_startup(site, executor):
+    """Restart the app on parents that are offline at startup and return the status snapshot.
+
+    The snapshot has to seed the monitor's fleet: the status client keeps the
+    response's validators, so the first poll only gets a 304 if nothing changed.
+    """
     logging.info("Checking for offline devices on startup...")
-    parent_devices, worker_devices = check_devices()
-    offline_parents = [device_id for device_id, device in parent_devices.items() if not device.get('isAlive', False)]
-    devices = get_connected_devices()
+    snapshot = site.status_client.fetch(site.min_poll_interval)
+    if snapshot is None:
+        return None
+    parent_devices, worker_devices, _ = snapshot
+    policy = site.policy
+    offline_parents = [device_id for device_id, device in parent_devices.items() if not device.is_alive]
+    now = clock.time()
+    policy.breaker.update(len(offline_parents), len(parent_devices), now)
+    if policy.breaker.is_open():
+        return snapshot
 
     for device_id in offline_parents:
-        if device_id in devices:
-            device_ip = devices[device_id]
+        if device_id in policy.devices:
+            continue  # Escalation restored from the last run carries on from where it was
+        device_ip = site.registry.address_of(device_id)
+        if device_ip:
             logging.info(f"Attempting to restart Cosmog app on device {device_id} at IP {device_ip}")
-            restart_cosmog_app(device_ip, device_id, grace_period_devices)
+            if executor.submit(device_id, "restart", restart_cosmog_app, device_ip, device_id):
+                policy.start(device_id, "restart", now)
         else:
-            logging.warning(f"Device {device_id} not found in {DEVICE_NAME_IP_FILE}")
-
-def monitor_and_restart():
-    global current_status, current_message, consecutive_problem_count
-    try:
-        last_offline_workers = None
-        offline_count = {}
-        low_worker_count = {}
-        devices = get_connected_devices()
-        grace_period_devices = {}
-        fix_offline_devices_on_startup(grace_period_devices)  # Fix offline devices on startup
-
-        # Initialize per-device offline counters
-        device_offline_counters = {device_id: 0 for device_id in devices.keys()}
-
+            logging.warning(f"Device {device_id} not found in {site.registry.path}")
+    return snapshot
+
+class FleetHistory:
+    """Append-only history of fleet health in a SQLite database.
+
+    Stores one row of fleet aggregates per poll and a row for every device state
+    transition (online, offline, restart, reboot, ...), rolls polls up into hourly
+    aggregates, and drops raw rows after HISTORY_RETENTION_DAYS and rollups after
+    HISTORY_ROLLUP_RETENTION_DAYS. The monitor's per-device counters are saved here
+    too, so they survive a restart.
+
+    Recording only appends to in-memory buffers. flush() writes them in one
+    transaction and is meant to be called from a worker thread.
+    """
+
+    def __init__(self, path=HISTORY_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._polls = []
+        self._transitions = []
+        self._counters = None
+        self._last_prune = 0
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS polls (
+                ts INTEGER PRIMARY KEY, total_parents INTEGER, offline_parents INTEGER,
+                total_workers INTEGER, unallocated_workers INTEGER, status TEXT) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS transitions (ts INTEGER, device_id TEXT, state TEXT);
+            CREATE INDEX IF NOT EXISTS transitions_device ON transitions (device_id, ts);
+            CREATE TABLE IF NOT EXISTS hourly (
+                hour INTEGER PRIMARY KEY, polls INTEGER, avg_offline_parents REAL, max_offline_parents INTEGER,
+                avg_unallocated_workers REAL, max_unallocated_workers INTEGER, min_total_workers INTEGER) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value TEXT);
+        """)
+        return db
+
+    def record_poll(self, fleet, status, ts=None):
+        with self._lock:
+            self._polls.append((int(ts or clock.time()), fleet.total_parents, len(fleet.offline_parents),
+                                fleet.total_workers, len(fleet.unallocated_workers), status))
+
+    def record_transition(self, device_id, state, ts=None):
+        with self._lock:
+            self._transitions.append((int(ts or clock.time()), device_id, state))
+
+    def save_counters(self, counters):
+        """Queue a snapshot of the monitor counters (a JSON serialisable dict per name)."""
+        with self._lock:
+            self._counters = dict(self._counters or {}, **{name: json.dumps(value) for name, value in counters.items()})
+
+    def load_counters(self):
+        try:
+            with closing(self._connect()) as db:
+                return {name: json.loads(value) for name, value in db.execute("SELECT name, value FROM counters")}
+        except (sqlite3.Error, ValueError) as e:
+            logging.error(f"Could not load counters from {self.path}: {e}")
+            return {}
+
+    def flush(self):
+        with self._lock:
+            polls, self._polls = self._polls, []
+            transitions, self._transitions = self._transitions, []
+            counters, self._counters = self._counters, None
+        if not (polls or transitions or counters):
+            return
+        try:
+            with closing(self._connect()) as db, db:
+                db.executemany("INSERT OR REPLACE INTO polls VALUES (?, ?, ?, ?, ?, ?)", polls)
+                db.executemany("INSERT INTO transitions VALUES (?, ?, ?)", transitions)
+                if counters:
+                    db.executemany("INSERT OR REPLACE INTO counters VALUES (?, ?)", counters.items())
+                if clock.time() - self._last_prune >= 3600:
+                    self._rollup_and_prune(db)
+                    self._last_prune = clock.time()
+        except sqlite3.Error as e:
+            logging.error(f"Could not write fleet history to {self.path}: {e}")
+
+    def _rollup_and_prune(self, db):
+        current_hour = int(clock.time()) // 3600 * 3600
+        # (Re)build rollups for every finished hour that still has raw polls
+        db.execute("""
+            INSERT OR REPLACE INTO hourly
+            SELECT ts / 3600 * 3600 AS hour, COUNT(*), AVG(offline_parents), MAX(offline_parents),
+                   AVG(unallocated_workers), MAX(unallocated_workers), MIN(total_workers)
+            FROM polls WHERE ts < ? AND ts >= COALESCE((SELECT MAX(hour) FROM hourly), 0)
+            GROUP BY hour""", (current_hour,))
+        raw_cutoff = int(clock.time()) - HISTORY_RETENTION_DAYS * 86400
+        db.execute("DELETE FROM polls WHERE ts < ?", (raw_cutoff,))
+        db.execute("DELETE FROM transitions WHERE ts < ?", (raw_cutoff,))
+        db.execute("DELETE FROM hourly WHERE hour < ?", (int(clock.time()) - HISTORY_ROLLUP_RETENTION_DAYS * 86400,))
+
+    def uptime(self, device_id, since, until=None):
+        """Fraction of the time between since and until (unix times) the device was online."""
+        until = until or clock.time()
+        with closing(self._connect()) as db:
+            before = db.execute("SELECT state FROM transitions WHERE device_id = ? AND ts < ? AND state IN ('online', 'offline') "
+                                "ORDER BY ts DESC LIMIT 1", (device_id, since)).fetchone()
+            rows = db.execute("SELECT ts, state FROM transitions WHERE device_id = ? AND ts >= ? AND ts < ? "
+                              "AND state IN ('online', 'offline') ORDER BY ts", (device_id, since, until)).fetchall()
+        if before is None and not rows:
+            return None
+        online = before is not None and before[0] == 'online'
+        last_ts = since
+        online_time = 0
+        for ts, state in rows:
+            if online:
+                online_time += ts - last_ts
+            online = state == 'online'
+            last_ts = ts
+        if online:
+            online_time += until - last_ts
+        return online_time / max(1, until - since)
+
+    def restarts_per_day(self, device_id=None, days=7):
+        """{'YYYY-MM-DD': count} of restarts and reboots, for one device or the whole fleet."""
+        query = ("SELECT date(ts, 'unixepoch'), COUNT(*) FROM transitions WHERE state IN ('restart', 'reboot') AND ts >= ?")
+        params = [int(clock.time()) - days * 86400]
+        if device_id is not None:
+            query += " AND device_id = ?"
+            params.append(device_id)
+        with closing(self._connect()) as db:
+            return dict(db.execute(query + " GROUP BY 1 ORDER BY 1", params).fetchall())
+
+    def flapping_devices(self, hours=24, min_transitions=6):
+        """{device_id: number of offline transitions} for devices that went offline at least min_transitions times."""
+        with closing(self._connect()) as db:
+            return dict(db.execute("SELECT device_id, COUNT(*) FROM transitions WHERE state = 'offline' AND ts >= ? "
+                                   "GROUP BY device_id HAVING COUNT(*) >= ? ORDER BY 2 DESC",
+                                   (int(clock.time()) - hours * 3600, min_transitions)).fetchall())
+
+    def recent_worker_counts(self, limit):
+        """Total worker counts of the last limit polls, oldest first."""
+        with closing(self._connect()) as db:
+            rows = db.execute("SELECT total_workers FROM polls ORDER BY ts DESC LIMIT ?", (limit,)).fetchall()
+        return [total_workers for total_workers, in reversed(rows)]
+
+    def fleet_series(self, since, until=None, hourly=False):
+        """Fleet aggregates between since and until, per poll or from the hourly rollups."""
+        until = until or clock.time()
+        with closing(self._connect()) as db:
+            if hourly:
+                return db.execute("SELECT * FROM hourly WHERE hour >= ? AND hour < ? ORDER BY hour", (since, until)).fetchall()
+            return db.execute("SELECT * FROM polls WHERE ts >= ? AND ts < ? ORDER BY ts", (since, until)).fetchall()
+
+history = FleetHistory()
+
+def site_file(section, key, default):
+    """File setting of a named site, defaults get the site name appended so sites don't share files."""
+    value = section.get(key, default)
+    if value == config['DEFAULT'].get(key, default):
+        stem, ext = os.path.splitext(value)
+        value = f"{stem}-{section.name}{ext}"
+    return value
+
+class Site:
+    """One Rotom instance and the devices behind it.
+
+    Every named section in config.ini is a site and every key it doesn't set falls back
+    to [DEFAULT]. Each site has its own status endpoint, subnets, device registry,
+    history, Discord webhook and thresholds. Without named sections [DEFAULT] is the
+    only site and uses the module level registry, history, notifier and status client.
+    """
+
+    def __init__(self, section, registry, history, notifier, status_client):
+        self.name = None if section.name == 'DEFAULT' else section.name
+        self.labels = {"site": self.name} if self.name else {}  # Extra metric labels
+        self.registry = registry
+        self.history = history
+        self.notifier = notifier
+        self.status_client = status_client
+        self.boot_stats = BootStats(history)
+        self.host = section.get('HOST', HOST)
+        self.port = section.getint('PORT', PORT)
+        self.subnets = section.get('SUBNETS', SUBNETS)
+        self.problem_check_interval = section.getint('PROBLEM_CHECK_INTERVAL', PROBLEM_CHECK_INTERVAL)
+        self.min_poll_interval = section.getint('MIN_POLL_INTERVAL', self.problem_check_interval)
+        self.max_poll_interval = section.getint('MAX_POLL_INTERVAL', section.getint('CHECK_INTERVAL', CHECK_INTERVAL))
+        self.max_wait_time = section.getint('MAX_WAIT_TIME', MAX_WAIT_TIME)
+        self.consecutive_problem_threshold = section.getint('CONSECUTIVE_PROBLEM_THRESHOLD', CONSECUTIVE_PROBLEM_THRESHOLD)
+        self.grace_period = section.getint('GRACE_PERIOD', GRACE_PERIOD)
+        self.policy = EscalationPolicy(
+            offline_threshold=section.getint('OFFLINE_THRESHOLD', OFFLINE_THRESHOLD),
+            bugged_threshold=section.getint('BUGGED_DEVICE_THRESHOLD', BUGGED_DEVICE_THRESHOLD),
+            max_restarts=section.getint('MAX_APP_RESTARTS', MAX_APP_RESTARTS),
+            max_reboots=section.getint('MAX_REBOOTS', MAX_REBOOTS),
+            backoff=section.getint('ESCALATION_BACKOFF', ESCALATION_BACKOFF),
+            backoff_max=section.getint('ESCALATION_BACKOFF_MAX', ESCALATION_BACKOFF_MAX),
+            quarantine_time=section.getint('QUARANTINE_TIME', QUARANTINE_TIME),
+            breaker=CircuitBreaker(
+                max_offline=section.getint('CIRCUIT_BREAKER_MAX_OFFLINE', CIRCUIT_BREAKER_MAX_OFFLINE),
+                max_offline_ratio=section.getfloat('CIRCUIT_BREAKER_MAX_OFFLINE_RATIO', CIRCUIT_BREAKER_MAX_OFFLINE_RATIO),
+                max_failures=section.getint('CIRCUIT_BREAKER_MAX_FAILURES', CIRCUIT_BREAKER_MAX_FAILURES),
+                cooldown=section.getint('CIRCUIT_BREAKER_COOLDOWN', CIRCUIT_BREAKER_COOLDOWN),
+                probes=section.getint('CIRCUIT_BREAKER_PROBES', CIRCUIT_BREAKER_PROBES)))
+        self.detector = WorkerAnomalyDetector(
+            window=section.getint('ANOMALY_WINDOW', ANOMALY_WINDOW),
+            min_samples=section.getint('ANOMALY_MIN_SAMPLES', ANOMALY_MIN_SAMPLES),
+            z_threshold=section.getfloat('ANOMALY_Z_THRESHOLD', ANOMALY_Z_THRESHOLD),
+            min_drop=section.getfloat('ANOMALY_MIN_DROP', ANOMALY_MIN_DROP),
+            min_std=section.getfloat('ANOMALY_MIN_STD', ANOMALY_MIN_STD),
+            backend=section.get('ANOMALY_BACKEND', ANOMALY_BACKEND))
+
+    @classmethod
+    def from_section(cls, section, session):
+        return cls(
+            section,
+            DeviceRegistry(site_file(section, 'DEVICE_REGISTRY_FILE', DEVICE_REGISTRY_FILE),
+                           site_file(section, 'DEVICE_NAME_IP_FILE', DEVICE_NAME_IP_FILE),
+                           site_file(section, 'DEVICE_IP_FILE', DEVICE_IP_FILE)),
+            FleetHistory(site_file(section, 'HISTORY_FILE', HISTORY_FILE)),
+            DiscordNotifier(section.get('DISCORD_WEBHOOK', DISCORD_WEBHOOK),
+                            site_file(section, 'DISCORD_STATE_FILE', DISCORD_STATE_FILE)),
+            StatusClient(section.get('STATUS_URL', STATUS_URL), section.getint('TIMEOUT', TIMEOUT), session=session))
+
+default_site = Site(config['DEFAULT'], registry, history, notifier, status_client)
+
+def load_sites():
+    names = config.sections()
+    if not names:
+        return [default_site]
+    # One status session for all sites, with a connection pool per Rotom host
+    session = create_status_session(hosts=len(names))
+    return [Site.from_section(config[name], session) for name in names]
+
+class Monitor:
+    """Asyncio monitor core.
+
+    Status polling, problem evaluation, remediation dispatch and Discord notifications
+    run as separate tasks that talk over queues, so a slow webhook or a device reboot
+    never delays the next status check. Blocking work (HTTP requests, adb) runs in
+    threads. All monitor state is only touched from the event loop.
+
+    One monitor runs per site. Monitors of several sites share the remediation pool.
+    """
+
+    def __init__(self, site=default_site, pool=None):
+        self.site = site
+        self.executor = RemediationExecutor(REMEDIATION_WORKERS, on_complete=self._remediation_done, pool=pool)
+        self.snapshots = asyncio.Queue(maxsize=1)  # poller -> evaluator, only the latest snapshot is kept
+        self.remediations = asyncio.Queue()  # evaluator -> dispatcher: (device_id, kind)
+        self.results = asyncio.Queue()  # executor -> monitor: RemediationResult
+        self.reschedule = asyncio.Event()
+        self.stopping = asyncio.Event()
+        self.scheduler = PollScheduler(site.min_poll_interval, site.max_poll_interval, site.problem_check_interval)
+
+        self.fleet = FleetState()
+        self.unregistered_devices = set()  # Parents reported by Rotom that aren't in the registry
+        self.unreachable_devices = set()  # Parents whose last job found nothing on their registered address
+        self.rediscovery = None
+        self.last_rediscovery = None
+        self.grace_period_devices = {}
+        self.policy = site.policy
+        self.detector = site.detector
+        self.last_offline_workers = None
+        self.consecutive_problem_count = 0
+        self.last_status = current_status
+        self.last_message = current_message
+        self.problem_start_time = None  # Set while a problem is being tracked
+        self.last_update_time = None
+        self.status_unavailable = False  # Set while the last poll failed
+        self.restore_counters()
+        metrics.add_collector(self.collect_metrics)
+
+    def labels(self, **labels):
+        return tuple(sorted({**self.site.labels, **labels}.items()))
+
+    def collect_metrics(self):
+        # Called from the metrics server thread at scrape time, only reads sizes
+        fleet = self.fleet
+        site = self.labels()
+        return [
+            ("cosmog_parents", "Parent devices reported by Rotom.", {site: fleet.total_parents}),
+            ("cosmog_offline_parents", "Parent devices that are not alive.", {site: len(fleet.offline_parents)}),
+            ("cosmog_workers", "Workers reported by Rotom.", {site: fleet.total_workers}),
+            ("cosmog_unallocated_workers", "Workers that are not allocated.", {site: len(fleet.unallocated_workers)}),
+            ("cosmog_low_worker_parents", "Alive parents with at most one allocated worker.", {site: len(fleet.low_worker_parents)}),
+            ("cosmog_degraded_parents", "Alive parents running clearly fewer workers than usual.", {site: len(self.detector.degraded)}),
+            ("cosmog_expected_workers", "Usual worker count, learned from recent polls.", {site: self.detector.expected_workers or 0}),
+            ("cosmog_grace_period_devices", "Devices in their grace period after a restart.", {site: len(self.grace_period_devices)}),
+            ("cosmog_escalation_devices", "Devices by escalation state.",
+             {self.labels(state=state): count for state, count in self.policy.state_counts().items()}),
+            ("cosmog_circuit_breaker_open", "1 while the circuit breaker halts remediation or limits it to probes.",
+             {site: int(self.policy.breaker.is_open())}),
+            ("cosmog_problem_mode", "1 while a problem is being tracked.", {site: int(self.in_problem_mode)}),
+            ("cosmog_poll_interval_seconds", "Current status poll interval.", {site: self.scheduler.interval}),
+        ]
+
+    def restore_counters(self):
+        counters = self.site.history.load_counters()
+        self.policy.load(counters.get('device_policy', {}))
+        try:
+            self.detector.seed(self.site.history.recent_worker_counts(self.detector.window))
+        except sqlite3.Error as e:
+            logging.error(f"Could not load worker counts from {self.site.history.path}: {e}")
+        self.last_offline_workers = counters.get('last_offline_workers')
+        self.consecutive_problem_count = counters.get('consecutive_problem_count', 0)
+        if counters:
+            logging.info(f"Restored escalation state for {len(self.policy.devices)} devices from {self.site.history.path}")
+
+    def save_counters(self):
+        self.site.history.save_counters({
+            'device_policy': self.policy.to_dict(),
+            'last_offline_workers': self.last_offline_workers,
+            'consecutive_problem_count': self.consecutive_problem_count,
+        })
+
+    @property
+    def in_problem_mode(self):
+        return self.problem_start_time is not None
+
+    def _remediation_done(self, result):
+        # Called from an executor thread
+        self.loop.call_soon_threadsafe(self.results.put_nowait, result)
+
+    def notify(self, status, message):
+        self.last_status = status
+        self.last_message = message
+        self.site.notifier.submit(status, message)
+
+    def run_in_thread(self, func, *args):
+        # Threads don't inherit the context, copy it so their logs keep the site prefix
+        return self.loop.run_in_executor(None, functools.partial(contextvars.copy_context().run, func, *args))
+
+    def fetch_status(self):
+        # Runs in a thread, also picks up registry changes made by discovery runs
+        # and writes out the history recorded since the last poll
+        self.site.registry.refresh()
+        self.site.history.flush()
+        return self.site.status_client.fetch(self.site.min_poll_interval)
+
+    async def poll_status(self):
         while True:
-            parent_devices, worker_devices = check_devices()
-            # Calculate total_workers and set thresholds dynamically
-            total_workers = len(worker_devices)
-            UNALLOCATED_WORKER_THRESHOLD = round(0.09 * total_workers)
-            MIN_WORKER_THRESHOLD = total_workers - UNALLOCATED_WORKER_THRESHOLD
-
-            status, message = get_status_summary(parent_devices, worker_devices)
-
-            # Build parent_workers mapping
-            parent_workers = {}
-            for worker_id, worker in worker_devices.items():
-                if worker.get('isAllocated', False):
-                    parent_device_id = worker.get('parentDeviceId')
-                    if parent_device_id:
-                        parent_workers.setdefault(parent_device_id, []).append(worker_id)
-
-            # Update low_worker_count for devices with 0-1 workers
-            for device_id, device in parent_devices.items():
-                if device_id in grace_period_devices:
-                    # Skip devices in grace period
-                    grace_start_time = grace_period_devices[device_id]
-                    if (datetime.now() - grace_start_time).total_seconds() >= GRACE_PERIOD:
-                        del grace_period_devices[device_id]
-                        logging.info(f"Grace period ended for device {device_id}")
-                    else:
-                        continue  # Skip this device
-
-                if device.get('isAlive', False):
-                    num_workers = len(parent_workers.get(device_id, []))
-                    if num_workers <= 1:
-                        low_worker_count[device_id] = low_worker_count.get(device_id, 0) + 1
-                    else:
-                        if device_id in low_worker_count:
-                            del low_worker_count[device_id]
-                else:
-                    if device_id in low_worker_count:
-                        del low_worker_count[device_id]
-
-            # Handle bugged devices
-            for device_id, count in list(low_worker_count.items()):
-                if count >= BUGGED_DEVICE_THRESHOLD:
-                    if device_id in devices:
-                        device_ip = devices[device_id]
-                        # Validate the device is actually bugged by attempting to restart Cosmog app first
-                        restart_cosmog_app(device_ip, device_id, grace_period_devices)
-                        # Since we start the grace period after restarting the app, we don't need to check immediately
-                        del low_worker_count[device_id]
-                    else:
-                        logging.warning(f"Device {device_id} not found in {DEVICE_NAME_IP_FILE}")
-                        del low_worker_count[device_id]
-
-            if status == "Potential Problem":
-                consecutive_problem_count += 1
-                if consecutive_problem_count >= CONSECUTIVE_PROBLEM_THRESHOLD:
-                    status = "Significant Problem"
-                    message = f"Worker count has been below {MIN_WORKER_THRESHOLD} for {CONSECUTIVE_PROBLEM_THRESHOLD} consecutive checks."
+            last_poll = self.loop.time()
+            try:
+                snapshot = await self.run_in_thread(self.fetch_status)
+            except Exception as e:
+                logging.error(f"Status poll failed: {e}", exc_info=True)
             else:
-                consecutive_problem_count = 0
+                if self.snapshots.full():
+                    self.snapshots.get_nowait()  # Evaluator fell behind, drop the stale snapshot
+                self.snapshots.put_nowait(snapshot)
+
+            while True:
+                remaining = last_poll + self.scheduler.interval - self.loop.time()
+                if remaining <= 0:
+                    break
+                self.reschedule.clear()
+                try:
+                    # Wake up early when the evaluator shortens the interval
+                    await asyncio.wait_for(self.reschedule.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def evaluate_status(self):
+        while True:
+            snapshot = await self.snapshots.get()
+            try:
+                self.evaluate_snapshot(snapshot)
+            except Exception as e:
+                logging.error(f"Evaluating the status failed: {e}", exc_info=True)
+
+    def dispatch(self, device_id, kind):
+        device_ip = self.site.registry.address_of(device_id)
+        if device_ip is None:
+            logging.warning(f"Device {device_id} not found in {self.site.registry.path}")
+            self.unregistered_devices.add(device_id)
+            self.start_rediscovery()
+            return
+        if kind == "reboot":
+            submitted = self.executor.submit(device_id, kind, reboot_and_start_device, device_ip, device_id,
+                                             functools.partial(self.is_alive, device_id), self.site)
+        else:
+            submitted = self.executor.submit(device_id, kind, restart_cosmog_app, device_ip, device_id)
+        if submitted:
+            # Only jobs that actually run move the device towards reboot and quarantine
+            self.policy.start(device_id, kind, clock.time())
 
-            if status != "Everything Good":
-                logging.warning(f"Problem detected: {status} - {message}")
-                current_status = status
-                current_message = f"Problem detected: {message}"
-                send_discord_embed()  # Post initial problem detection to Discord
+    async def dispatch_remediation(self):
+        while True:
+            device_id, kind = await self.remediations.get()
+            try:
+                self.dispatch(device_id, kind)
+            except Exception as e:
+                logging.error(f"Dispatching {kind} for device {device_id} failed: {e}", exc_info=True)
+
+    def handle_result(self, result):
+        self.site.history.record_transition(result.device_id, result.kind if result.ok else f"{result.kind}_failed")
+        counter = reboots_total if result.kind == "reboot" else restarts_total
+        counter.inc(device_id=result.device_id, result="ok" if result.ok else "failed", **self.site.labels)
+        if result.ok:
+            logging.info(f"{result.kind} job for device {result.device_id} finished in {result.duration:.1f}s")
+            # Start grace period after starting the app
+            self.grace_period_devices[result.device_id] = result.finished_at
+        else:
+            logging.error(f"{result.kind} job for device {result.device_id} failed after {result.duration:.1f}s")
+            if isinstance(result.error, DeviceUnreachable):
+                self.unreachable_devices.add(result.device_id)
+                self.start_rediscovery()
+        if self.policy.record_result(result, clock.time()):
+            self.site.notifier.submit("Major Issue", f"Remediation halted for {self.policy.breaker.cooldown}s: {self.policy.breaker.reason}.")
+
+    async def collect_remediation_results(self):
+        while True:
+            result = await self.results.get()
+            try:
+                self.handle_result(result)
+            except Exception as e:
+                logging.error(f"Handling the {result.kind} result of device {result.device_id} failed: {e}", exc_info=True)
 
-                start_time = datetime.now()
-                last_update_time = start_time
+    def is_alive(self, device_id):
+        # Read from executor threads, set membership checks are atomic
+        return device_id in self.fleet.parents and device_id not in self.fleet.offline_parents
 
-                while True:
-                    # Update grace period devices
-                    for device_id in list(grace_period_devices.keys()):
-                        grace_start_time = grace_period_devices[device_id]
-                        if (datetime.now() - grace_start_time).total_seconds() >= GRACE_PERIOD:
-                            del grace_period_devices[device_id]
-                            logging.info(f"Grace period ended for device {device_id}")
-
-                    # Check and repair offline devices
-                    offline_parents = [device_id for device_id, device in parent_devices.items() if
-                                       not device.get('isAlive', False)]
-
-                    for device_id in offline_parents:
-                        if device_id in grace_period_devices:
-                            continue  # Skip devices in grace period
-                        # Increment the offline counter
-                        device_offline_counters[device_id] = device_offline_counters.get(device_id, 0) + 1
-                        logging.debug(f"Device {device_id} offline count: {device_offline_counters[device_id]}")
-
-                        if device_offline_counters[device_id] >= 3:
-                            devices = get_connected_devices()  # Refresh the devices list
-                            if device_id in devices:
-                                device_ip = devices[device_id]
-                                logging.info(f"Attempting to restart Cosmog app on device {device_id}")
-                                restart_cosmog_app(device_ip, device_id, grace_period_devices)
-                                device_offline_counters[device_id] = 0  # Reset counter after attempt
-                            else:
-                                logging.warning(f"Device {device_id} not found in {DEVICE_NAME_IP_FILE}")
-
-                    # Reset offline counters for devices that are now online
-                    for device_id in list(device_offline_counters.keys()):
-                        if device_id not in offline_parents:
-                            device_offline_counters[device_id] = 0
-
-                    # Update low_worker_count for devices with 0-1 workers
-                    for device_id, device in parent_devices.items():
-                        if device_id in grace_period_devices:
-                            continue  # Skip devices in grace period
-                        if device.get('isAlive', False):
-                            num_workers = len(parent_workers.get(device_id, []))
-                            if num_workers <= 1:
-                                low_worker_count[device_id] = low_worker_count.get(device_id, 0) + 1
-                            else:
-                                if device_id in low_worker_count:
-                                    del low_worker_count[device_id]
-                        else:
-                            if device_id in low_worker_count:
-                                del low_worker_count[device_id]
-
-                    # Handle bugged devices (as above)
-                    for device_id, count in list(low_worker_count.items()):
-                        if count >= BUGGED_DEVICE_THRESHOLD:
-                            if device_id in devices:
-                                device_ip = devices[device_id]
-                                # Validate the device is actually bugged by attempting to restart Cosmog app first
-                                restart_cosmog_app(device_ip, device_id, grace_period_devices)
-                                del low_worker_count[device_id]
-                            else:
-                                logging.warning(f"Device {device_id} not found in {DEVICE_NAME_IP_FILE}")
-                                del low_worker_count[device_id]
-
-                    time.sleep(PROBLEM_CHECK_INTERVAL)
-                    parent_devices, worker_devices = check_devices()
-                    # Recalculate thresholds
-                    total_workers = len(worker_devices)
-                    UNALLOCATED_WORKER_THRESHOLD = round(0.09 * total_workers)
-                    MIN_WORKER_THRESHOLD = total_workers - UNALLOCATED_WORKER_THRESHOLD
-
-                    new_status, new_message = get_status_summary(parent_devices, worker_devices)
-                    offline_workers = len([worker_id for worker_id, worker in worker_devices.items() if
-                                           not worker.get('isAllocated', False)])
-
-                    logging.debug(f"Offline workers: {offline_workers}, Last offline workers: {last_offline_workers}")
-
-                    # Update Discord every PROBLEM_CHECK_INTERVAL
-                    if (datetime.now() - last_update_time) >= timedelta(seconds=PROBLEM_CHECK_INTERVAL):
-                        current_status = new_status
-                        current_message = f"Current status: {new_message}"
-                        send_discord_embed()
-                        last_update_time = datetime.now()
-
-                    if last_offline_workers is not None:
-                        if offline_workers < last_offline_workers:
-                            current_status = "Improving"
-                            current_message = f"Situation improving: {offline_workers} workers offline (down from {last_offline_workers})."
-                            send_discord_embed()
-                            logging.info("Situation improving.")
-                        elif offline_workers > last_offline_workers:
-                            current_status = "Deteriorating"
-                            current_message = f"Situation worsening: {offline_workers} workers offline (up from {last_offline_workers})."
-                            send_discord_embed()
-                            logging.warning("Situation worsening.")
-                    else:
-                        logging.debug("Initializing last_offline_workers")
-
-                    last_offline_workers = offline_workers
-
-                    if new_status == "Everything Good":
-                        current_status = "Resolved"
-                        current_message = f"Issue resolved: {new_message}"
-                        send_discord_embed()
-                        logging.info("Problem resolved.")
-                        break
+    def start_rediscovery(self):
+        if self.rediscovery is not None and not self.rediscovery.done():
+            return
+        now = clock.monotonic()
+        if self.last_rediscovery is not None and now - self.last_rediscovery < REDISCOVERY_COOLDOWN:
+            return
+        # Devices that moved to a new address show up as missing, offline or unreachable
+        suspects = self.unregistered_devices | self.unreachable_devices | self.fleet.offline_parents
+        logging.info(f"Starting rediscovery for {len(self.unregistered_devices)} unregistered and "
+                     f"{len(self.unreachable_devices)} unreachable devices.")
+        self.last_rediscovery = now
+        self.rediscovery = self.run_in_thread(discover_devices, suspects, self.site)
+        self.rediscovery.add_done_callback(functools.partial(self._rediscovery_done, set(self.unreachable_devices)))
+
+    def _rediscovery_done(self, unreachable, future):
+        if future.cancelled():
+            return
+        if future.exception():
+            logging.error(f"Rediscovery failed: {future.exception()}")
+            return
+        self.unregistered_devices = {device_id for device_id in self.unregistered_devices if device_id not in self.site.registry}
+        self.unreachable_devices -= unreachable  # Scanned for, new jobs use the address found if it moved
+
+    def expire_grace_periods(self):
+        for device_id in list(self.grace_period_devices.keys()):
+            grace_start_time = self.grace_period_devices[device_id]
+            if (clock.now() - grace_start_time).total_seconds() >= self.site.grace_period:
+                del self.grace_period_devices[device_id]
+                logging.info(f"Grace period ended for device {device_id}")
+
+    def is_excluded(self, device_id):
+        # Skip devices in grace period or with remediation in progress
+        return device_id in self.grace_period_devices or self.executor.is_busy(device_id)
+
+    def apply_escalation_policy(self):
+        now = clock.time()
+        unhealthy = dict.fromkeys(self.detector.degraded, "degraded")
+        unhealthy.update(dict.fromkeys(self.fleet.low_worker_parents, "bugged"))
+        unhealthy.update(dict.fromkeys(self.fleet.offline_parents, "offline"))
+
+        actions, quarantined = self.policy.evaluate(unhealthy, self.is_excluded, now)
+        for device_id, kind in actions:
+            self.remediations.put_nowait((device_id, kind))
+        for device_id in quarantined:
+            self.site.history.record_transition(device_id, QUARANTINED)
+            self.site.notifier.submit("Bugged", f"Device {device_id} quarantined for {self.policy.quarantine_time}s, "
+                                      f"app restarts and reboots did not bring it back.")
+
+    def status_summary(self):
+        if self.status_unavailable:
+            return "Critical Problem", "Could not fetch the device status from Rotom."
+        return get_status_summary(self.fleet, self.policy.breaker, self.detector)
+
+    def evaluate_snapshot(self, snapshot):
+        if snapshot is None:
+            self.evaluate_unavailable()
+        else:
+            self.evaluate(*snapshot)
+
+    def evaluate_unavailable(self):
+        """Report a failed poll, leaving the fleet, escalation state and history as they were."""
+        self.status_unavailable = True
+        status, message = self.status_summary()
+        self.expire_grace_periods()
+        if self.in_problem_mode:
+            self.track_problem(status, message)
+        else:
+            self.check_for_problem(status, message)
+        self.save_counters()
+        old_interval = self.scheduler.interval
+        if self.scheduler.update(0, self.in_problem_mode) < old_interval:
+            self.reschedule.set()
+
+    def evaluate(self, parent_devices, worker_devices, changed=True):
+        self.status_unavailable = False
+        events = self.fleet.apply(parent_devices, worker_devices) if changed else []
+        for event in events:
+            if event.kind == "parent_added" and event.device_id not in self.site.registry:
+                self.unregistered_devices.add(event.device_id)
+            elif event.kind == "parent_removed":
+                self.unregistered_devices.discard(event.device_id)
+                self.unreachable_devices.discard(event.device_id)
+            if event.kind in ("parent_offline", "parent_online"):
+                self.site.history.record_transition(event.device_id, event.kind[len("parent_"):])
+            elif event.kind == "parent_added" and event.device_id not in self.fleet.offline_parents:
+                self.site.history.record_transition(event.device_id, "online")
+            if event.kind in ("parent_offline", "parent_online", "parent_removed"):
+                logging.info(f"Fleet change: {event.kind} {event.device_id}")
+            else:
+                logging.debug(f"Fleet change: {event.kind} {event.device_id} (parent {event.parent_id})")
 
-                    # Check if it's been an hour since the last improvement
-                    if (datetime.now() - start_time) >= timedelta(seconds=MAX_WAIT_TIME):
-                        current_status = "Persistent Problem"
-                        current_message = f"No significant change after an hour: {new_message}"
-                        send_discord_embed()
-                        logging.error(current_message)
-                        logging.info("Pausing monitoring due to lack of improvement in the last hour.")
-                        input("Press Enter to resume monitoring...")
-                        break
+        if self.unregistered_devices:
+            self.unregistered_devices = {device_id for device_id in self.unregistered_devices if device_id not in self.site.registry}
+        if self.unregistered_devices or self.unreachable_devices:
+            self.start_rediscovery()  # Retried once the cooldown is over
 
-            else:
-                if status != current_status or message != current_message:
-                    current_status = status
-                    current_message = message
-                    send_discord_embed()
-                    logging.info(f"Status update: {status} - {message}")
+        self.detector.update(self.fleet, bool(events))
+        self.policy.breaker.update(len(self.fleet.offline_parents), self.fleet.total_parents, clock.time())
+        status, message = self.status_summary()
+        self.expire_grace_periods()
+        self.apply_escalation_policy()
 
-            time.sleep(CHECK_INTERVAL)
+        if self.in_problem_mode:
+            self.track_problem(status, message)
+        else:
+            self.check_for_problem(status, message)
+
+        self.site.history.record_poll(self.fleet, status)
+        self.save_counters()
+
+        old_interval = self.scheduler.interval
+        if self.scheduler.update(len(events), self.in_problem_mode) < old_interval:
+            self.reschedule.set()
+
+    def check_for_problem(self, status, message):
+        if status == "Potential Problem":
+            self.consecutive_problem_count += 1
+            if self.consecutive_problem_count >= self.site.consecutive_problem_threshold:
+                MIN_WORKER_THRESHOLD = self.fleet.thresholds(self.detector.expected_workers)[1]
+                status = "Significant Problem"
+                message = f"Worker count has been below {MIN_WORKER_THRESHOLD} for {self.site.consecutive_problem_threshold} consecutive checks."
+        else:
+            self.consecutive_problem_count = 0
+
+        if status != "Everything Good":
+            logging.warning(f"Problem detected: {status} - {message}")
+            self.notify(status, f"Problem detected: {message}")  # Post initial problem detection to Discord
+            self.problem_start_time = clock.now()
+            self.last_update_time = self.problem_start_time
+        elif status != self.last_status or message != self.last_message:
+            self.notify(status, message)
+            logging.info(f"Status update: {status} - {message}")
+
+    def track_problem(self, new_status, new_message):
+        offline_workers = len(self.fleet.unallocated_workers)
+
+        logging.debug(f"Offline workers: {offline_workers}, Last offline workers: {self.last_offline_workers}")
+
+        # Update Discord every PROBLEM_CHECK_INTERVAL
+        if (clock.now() - self.last_update_time) >= timedelta(seconds=self.site.problem_check_interval):
+            self.notify(new_status, f"Current status: {new_message}")
+            self.last_update_time = clock.now()
+
+        if self.last_offline_workers is not None:
+            if offline_workers < self.last_offline_workers:
+                self.notify("Improving", f"Situation improving: {offline_workers} workers offline (down from {self.last_offline_workers}).")
+                logging.info("Situation improving.")
+            elif offline_workers > self.last_offline_workers:
+                self.notify("Deteriorating", f"Situation worsening: {offline_workers} workers offline (up from {self.last_offline_workers}).")
+                logging.warning("Situation worsening.")
+        else:
+            logging.debug("Initializing last_offline_workers")
+
+        self.last_offline_workers = offline_workers
+
+        if new_status == "Everything Good":
+            self.notify("Resolved", f"Issue resolved: {new_message}")
+            logging.info("Problem resolved.")
+            self.end_problem_mode()
+        elif (clock.now() - self.problem_start_time) >= timedelta(seconds=self.site.max_wait_time):
+            # Check if it's been an hour since the last improvement
+            message = f"No significant change after an hour: {new_message}"
+            self.notify("Persistent Problem", message)
+            logging.error(message)
+            logging.info("Falling back to regular checks due to lack of improvement in the last hour.")
+            self.end_problem_mode()
+
+    def end_problem_mode(self):
+        self.problem_start_time = None
+
+    def request_stop(self):
+        self.stopping.set()
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        current_site.set(self.site.name)  # Inherited by the tasks created below
+        devices = await self.run_in_thread(get_connected_devices, self.site.registry)
+        await self.run_in_thread(adb_pool.connect_all, devices.values())
+        snapshot = await self.run_in_thread(fix_offline_devices_on_startup, self.site, self.executor)  # Fix offline devices on startup
+        if snapshot is not None:
+            self.evaluate(*snapshot)  # Seeds the fleet before the first poll, which may be a 304
+
+        coros = [
+            self.poll_status(),
+            self.evaluate_status(),
+            self.dispatch_remediation(),
+            self.collect_remediation_results(),
+        ]
+        if self.site.notifier is not notifier:
+            coros.append(self.site.notifier.run())  # The shared notifier is run by run_monitor()
+        tasks = [self.loop.create_task(coro) for coro in coros]
+        stopping = self.loop.create_task(self.stopping.wait())
+        try:
+            # The loops only end by raising, stop the monitor instead of running on without them
+            done, _ = await asyncio.wait(tasks + [stopping], return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task is not stopping:
+                    logging.critical(f"Monitor task {task.get_coro().__qualname__} stopped, stopping the monitor.",
+                                     exc_info=task.exception())
+                    task.result()
+        finally:
+            stopping.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.executor.shutdown(wait=False)
+            await self.run_in_thread(self.site.history.flush)
+            if self.site.notifier is not notifier:
+                await self.run_in_thread(self.site.notifier.flush)
+
+STATUS_SEVERITY = ["Everything Good", "Minor Issue", "Problem", "Potential Problem", "Major Issue", "Critical Problem"]
+
+def get_sites_summary(monitors):
+    """Combined status of all sites: the worst site status and one line per site."""
+    statuses = [(monitor.site.name, *monitor.status_summary()) for monitor in monitors]
+    status = max((status for _, status, _ in statuses), key=STATUS_SEVERITY.index)
+    offline = sum(len(monitor.fleet.offline_parents) for monitor in monitors)
+    parents = sum(monitor.fleet.total_parents for monitor in monitors)
+    workers = sum(monitor.fleet.total_workers for monitor in monitors)
+    lines = [f"{len(monitors)} sites: {offline}/{parents} parent devices offline, {workers} workers."]
+    lines.extend(f"{name}: {status} - {message}" for name, status, message in statuses)
+    return status, "\n".join(lines)
+
+async def report_sites(monitors, interval=MIN_POLL_INTERVAL):
+    last_summary = None
+    while True:
+        await asyncio.sleep(interval)
+        summary = get_sites_summary(monitors)
+        if summary != last_summary:
+            logging.info(f"Sites summary: {summary[0]} - {summary[1]}")
+            notifier.submit(*summary)
+            last_summary = summary
+
+async def run_monitor(sites=None):
+    global current_status, current_message
+    # Create the monitors inside the running loop so their queues and events bind to it
+    sites = sites or load_sites()
+    pool = ThreadPoolExecutor(max_workers=max(1, REMEDIATION_WORKERS), thread_name_prefix="remediation")
+    monitors = [Monitor(site, pool) for site in sites]
+
+    def stop():
+        shutting_down.set()  # Running reboots stop waiting on their device
+        for monitor in monitors:
+            monitor.request_stop()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop)
+        except (NotImplementedError, RuntimeError):
+            pass  # Not supported on this platform, KeyboardInterrupt still cancels run()
+
+    tasks = [loop.create_task(notifier.run())]
+    if len(monitors) > 1:
+        tasks.append(loop.create_task(report_sites(monitors)))
+    runs = [loop.create_task(monitor.run()) for monitor in monitors]
+    message = "Monitoring script has been stopped by the user."
+    try:
+        await asyncio.gather(*runs)
+    except Exception as e:
+        message = f"Monitoring script stopped after an error: {e}"
+        raise
+    finally:
+        stop()  # A monitor that failed takes the other sites down with it
+        await asyncio.gather(*runs, return_exceptions=True)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        pool.shutdown(wait=False, cancel_futures=True)  # Queued jobs are dropped, running ones end at their next wait
+        logging.info(message)
+        current_status = "Script Stopped"
+        current_message = message
+        await loop.run_in_executor(None, send_discord_embed)
 
+def monitor_and_restart(sites=None):
+    try:
+        asyncio.run(run_monitor(sites))
     except KeyboardInterrupt:
-        logging.info("Monitoring stopped by user.")
-        current_status = "Script Stopped"
-        current_message = "Monitoring script has been stopped by the user."
-        send_discord_embed()
-
-def discover_devices():
-    with open(DEVICE_IP_FILE, "w") as f, open(DEVICE_NAME_IP_FILE, "w") as x:
-        for DeviceIP in range(2, 255):
-            ip = f"{HOST}{DeviceIP}"
-            if is_port_open(ip, PORT):
-                logging.info(f"[+] {ip}:{PORT} is open")
-                if write_devicename(f"{ip}:{PORT}"):
-                    f.write(f"{ip}:{PORT}\n")
+        pass
+
+def get_scan_targets(subnets=SUBNETS, host=HOST):
+    """Expand SUBNETS (comma separated CIDR ranges) into the list of hosts to probe.
+
+    Falls back to the /24 behind the legacy HOST prefix when SUBNETS is not set.
+    """
+    subnets = [subnet.strip() for subnet in subnets.split(',') if subnet.strip()]
+    if not subnets:
+        subnets = [f"{host}0/24"]
+
+    targets = []
+    seen = set()
+    for subnet in subnets:
+        try:
+            network = ipaddress.ip_network(subnet, strict=False)
+        except ValueError:
+            logging.error(f"Invalid subnet {subnet} in SUBNETS, skipping.")
+            continue
+        for ip in network.hosts():
+            ip = str(ip)
+            if ip not in seen:
+                seen.add(ip)
+                targets.append(ip)
+    return targets
+
+def probe_hosts(targets, port=PORT):
+    open_hosts = []
+    with ThreadPoolExecutor(max_workers=max(1, SCAN_WORKERS)) as pool:
+        for ip, is_open in pool.map(lambda ip: (ip, is_port_open(ip, port)), targets):
+            if is_open:
+                logging.info(f"[+] {ip}:{port} is open")
+                open_hosts.append(f"{ip}:{port}")
             else:
-                logging.debug(f"[!] {ip}:{PORT} is closed")
+                logging.debug(f"[!] {ip}:{port} is closed")
+    return open_hosts
+
+def fingerprint_hosts(hostports):
+    with ThreadPoolExecutor(max_workers=max(1, FINGERPRINT_WORKERS)) as pool:
+        device_names = list(pool.map(fingerprint_device, hostports))
+    return [(device_id, hostport) for hostport, device_id in zip(hostports, device_names) if device_id]
+
+@timed("discover_devices")
+def discover_devices(suspects=None, site=default_site):
+    """Scan the site's subnets and store every device found in its registry.
+
+    With suspects (device ids that are missing from the registry or not responding),
+    only addresses that are not in the registry or belong to a suspect are probed and
+    fingerprinted. Without it every address is.
+    """
+    targets = get_scan_targets(site.subnets, site.host)
+    if suspects is not None:
+        known_good = {address.rsplit(':', 1)[0] for device_id, address in site.registry.devices().items()
+                      if device_id not in suspects}
+        targets = [ip for ip in targets if ip not in known_good]
+
+    # Phase 1: probe every address concurrently
+    scan_start = time.monotonic()
+    open_hosts = probe_hosts(targets, site.port)
+    scan_time = time.monotonic() - scan_start
+
+    # Phase 2: read the device_id from every open host in parallel
+    fingerprint_start = time.monotonic()
+    found = fingerprint_hosts(open_hosts)
+    fingerprint_time = time.monotonic() - fingerprint_start
+
+    # Phase 3: write the results
+    write_start = time.monotonic()
+    site.registry.record(found)
+    write_time = time.monotonic() - write_start
+
+    logging.info(f"Discovery finished: {len(targets)} addresses scanned in {scan_time:.2f}s, "
+                 f"{len(open_hosts)} open, {len(found)} fingerprinted in {fingerprint_time:.2f}s, "
+                 f"registry updated in {write_time:.2f}s.")
+    return found
 
 if __name__ == "__main__":
+    start_metrics_server()
     send_discord_embed()
-    discover_devices()
-    monitor_and_restart()
+    sites = load_sites()
+    for site in sites:
+        current_site.set(site.name)
+        # Warm start from the registry, the monitor rediscovers missing devices in the background
+        if not site.registry.load():
+            discover_devices(site=site)
+    current_site.set(None)
+    monitor_and_restart(sites)